@@ -0,0 +1,322 @@
+from base import *
+from dataset import *
+from pairing import *
+from search import *
+from utils import *
+
+import numpy as np
+import random
+import math
+
+
+METHODS = ('annealing', 'late_acceptance')
+
+
+class AnnealingSolution(AnytimeSearch):
+    """
+    Simulated annealing or late acceptance hill climbing over the order of the slides and the pairing of
+    vertical photos. Moves :
+    - reverse a segment (2-opt) so that a slide and a slide sharing a tag with it become neighbors,
+    - relocate a slide right after a slide sharing a tag with it,
+    - exchange photos between two vertical slides.
+    The state is held in flat arrays : the sequence of slides, the position of every slide, and the transition
+    score at every position (as in Slideshow.scores). A move is scored incrementally : the transitions it removes
+    are read from the array, only the ones it creates are computed, on frozensets of tag ids.
+    """
+
+    def __init__(self, filename, pairing=DEFAULT_PAIRING):
+        self.dataset = load_dataset(filename, pairing=pairing)
+        self.slides = self.dataset.slides
+        print(f'Num slides : {len(self.slides)}')
+        self.store = self.dataset.store
+        photos = self.dataset.photos
+        self.photo_sets = [frozenset(photos.get_tags(p).tolist()) for p in range(len(photos))]
+
+        # Slides sharing a tag, to draw the candidate moves
+        positions, owners = csr_positions(self.store.indptr, np.arange(len(self.store)))
+        tags = self.store.indices[positions]
+        by_tag = np.argsort(tags, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(tags, minlength=self.store.num_tags))])
+        slides = owners[by_tag]
+        self.postings = [slides[bounds[t]:bounds[t+1]].tolist() for t in range(self.store.num_tags)]
+        self.slide_tags = [tuple(self.store.get_tags(i).tolist()) for i in range(len(self.store))]
+
+    def initial_sequence(self, initial=None):
+        """ Slide indexes of the initial solution :
+        - the dataset order if initial is None,
+        - initial itself if it is a sequence of slide indexes,
+        - the indexes of its slides if it is a Slideshow : read directly if its catalog is self.slides, otherwise
+          found from the photos of its slides (e.g. a slideshow of another instance of the same dataset).
+        :raises ValueError: If a slide of initial is not a slide of the dataset, or initial does not hold
+        every slide exactly once.
+        """
+        if initial is None:
+            return list(range(len(self.slides)))
+        if not isinstance(initial, Slideshow):
+            sequence = [int(i) for i in initial]
+        elif initial.catalog is self.slides:
+            sequence = initial.indexes.tolist()
+        else:
+            sequence = self._indexes_by_photos(initial)
+        if sorted(sequence) != list(range(len(self.slides))):
+            raise ValueError(f'The initial solution must hold every one of the {len(self.slides)} slides exactly once.')
+        return sequence
+
+    def _indexes_by_photos(self, slideshow):
+        """ Indexes of the slides of a slideshow, found from the indexes of their photos. """
+        slide_idx = {tuple(sorted(p for p in photos if p >= 0)): i
+                     for i, photos in enumerate(self.dataset.content.tolist())}
+        if isinstance(slideshow.catalog, SlideList):
+            # Slides of a dataset : the photos of a file have the same indexes in every instance
+            keys = [tuple(sorted(p for p in photos if p >= 0))
+                    for photos in slideshow.catalog.dataset.content[slideshow.indexes].tolist()]
+        else:
+            # Slides built elsewhere : only the Photo objects of this dataset are known
+            photo_idx = {id(photo): p for p, photo in self.dataset._photos.items()}
+            keys = [tuple(sorted(photo_idx.get(id(photo), -1) for photo in slide.get_content()))
+                    for slide in slideshow.get_slides()]
+        sequence = [slide_idx.get(key) for key in keys]
+        if None in sequence:
+            raise ValueError(f'The slide at position {sequence.index(None)} of the initial slideshow is not a slide '
+                             'of the dataset (photos of another dataset, or paired differently).')
+        return sequence
+
+    def reset(self, initial=None):
+        """ Sets the current solution. """
+        content = np.array(self.dataset.content, dtype=np.int64)
+        self.content = content
+        self.sets = [self.photo_sets[p1] | self.photo_sets[p2] if p2 >= 0 else self.photo_sets[p1]
+                     for p1, p2 in content.tolist()]
+        self.sizes = [len(tags) for tags in self.sets]
+        sequence = self.initial_sequence(initial)
+        self.sequence = np.array(sequence, dtype=np.int64)
+        self.position = np.full(len(self.slides), -1, dtype=np.int64)
+        self.position[self.sequence] = np.arange(len(sequence))
+        self.transitions = np.array([self.score_ids(a, b) for a, b in zip(sequence, sequence[1:])], dtype=np.int64)
+        self.score = int(self.transitions.sum())
+
+    def score_ids(self, a, b):
+        c = len(self.sets[a] & self.sets[b])
+        return min(c, self.sizes[a] - c, self.sizes[b] - c)
+
+    def _repair_delta(self, p, q, tags_p, tags_q):
+        """ Change of score if the slides at positions p and q had the tags tags_p and tags_q. """
+        seq, trans, sets = self.sequence, self.transitions, self.sets
+        n = len(seq)
+        delta = 0
+        for e in {p - 1, p, q - 1, q}:
+            if 0 <= e < n - 1:
+                left = tags_p if e == p else tags_q if e == q else sets[seq[e]]
+                right = tags_p if e + 1 == p else tags_q if e + 1 == q else sets[seq[e+1]]
+                c = len(left & right)
+                delta += min(c, len(left) - c, len(right) - c) - trans[e]
+        return delta
+
+    @PROFILER.traced('annealing.search')
+    def search(self, iterations=None, budget=None, method='annealing', t0=1.0, t1=0.05, history_size=5,
+               move_probs=(0.6, 0.3, 0.1), verbose=1):
+        """ Improves the current solution (see reset) for the given number of iterations or seconds.
+        :param iterations: Number of moves evaluated. None for no limit.
+        :param budget: Time budget in seconds. None for no limit.
+        :param method: 'annealing' or 'late_acceptance'.
+        :param t0: Initial temperature (annealing).
+        :param t1: Final temperature (annealing), reached geometrically at the end of the iterations / budget.
+        :param history_size: Length of the score history (late acceptance).
+        :param move_probs: Probabilities of the reverse, relocate and vertical exchange moves.
+        :return: Report of the run (dict), also kept in self.report.
+        """
+        assert method in METHODS, f"Unknown method '{method}', expected one of {METHODS}."
+        assert iterations is not None or budget is not None, "Give a number of iterations or a time budget."
+        self.start_search(budget)
+        seq, pos, trans, content = self.sequence, self.position, self.transitions, self.content
+        sets, sizes, photo_sets = self.sets, self.sizes, self.photo_sets
+        postings, slide_tags = self.postings, self.slide_tags
+        rand, randrange, choice, exp = random.random, random.randrange, random.choice, math.exp
+        annealing = method == 'annealing'
+        p_reverse, p_relocate = move_probs[0], move_probs[0] + move_probs[1]
+        n = len(seq)
+        last = n - 1
+
+        initial_score = score = best_score = self.score
+        # Copy of the best state, only taken when a move leaves it (None while the current state is the best)
+        best = None
+        max_iterations = iterations if iterations is not None else float('inf')
+        history = [score] * history_size
+        temperature = t0
+        it = accepted = 0
+        while n > 2 and it < max_iterations:
+            if it & 255 == 0:
+                # Cooperative checks, every 256 moves
+                self.score = score
+                if self.expired():
+                    break
+                progress = max(it / iterations if iterations else 0., self.deadline.elapsed() / budget if budget else 0.)
+                temperature = t0 * (t1 / t0) ** min(progress, 1.)
+            it += 1
+
+            i = randrange(n)
+            a = seq[i]
+            tags = slide_tags[a]
+            if len(tags) == 0:
+                continue
+            b = choice(postings[choice(tags)])
+            k = pos[b]
+            if b == a:
+                continue
+            u = rand()
+            if u < p_reverse:
+                kind = 0
+                l, r = (i + 1, k) if i < k else (k, i - 1)
+                if l >= r:
+                    continue
+                x, y = seq[l], seq[r]
+                new_left = new_right = 0
+                delta = 0
+                if l > 0:
+                    z = seq[l-1]
+                    c = len(sets[z] & sets[y])
+                    new_left = min(c, sizes[z] - c, sizes[y] - c)
+                    delta += new_left - trans[l-1]
+                if r < last:
+                    z = seq[r+1]
+                    c = len(sets[x] & sets[z])
+                    new_right = min(c, sizes[x] - c, sizes[z] - c)
+                    delta += new_right - trans[r]
+            elif u < p_relocate:
+                # Slide b, at position k, goes right after slide a
+                kind = 1
+                if k == i + 1:
+                    continue
+                delta = 0
+                if k > 0:
+                    delta -= trans[k-1]
+                if k < last:
+                    delta -= trans[k]
+                gap = 0
+                if 0 < k < last:
+                    x, y = seq[k-1], seq[k+1]
+                    c = len(sets[x] & sets[y])
+                    gap = min(c, sizes[x] - c, sizes[y] - c)
+                c = len(sets[a] & sets[b])
+                after_a = min(c, sizes[a] - c, sizes[b] - c)
+                after_b = 0
+                if i < last:
+                    z = seq[i+1]
+                    c = len(sets[b] & sets[z])
+                    after_b = min(c, sizes[b] - c, sizes[z] - c)
+                    delta -= trans[i]
+                delta += gap + after_a + after_b
+            else:
+                kind = 2
+                x1, x2 = content[a, 0], content[a, 1]
+                y1, y2 = content[b, 0], content[b, 1]
+                if x2 < 0 or y2 < 0:
+                    continue
+                if rand() < 0.5:
+                    y1, y2 = y2, y1
+                # a gets (x1, y2), b gets (y1, x2)
+                tags_a, tags_b = photo_sets[x1] | photo_sets[y2], photo_sets[y1] | photo_sets[x2]
+                delta = self._repair_delta(i, k, tags_a, tags_b)
+
+            if annealing:
+                ok = delta >= 0 or rand() < exp(delta / temperature)
+            else:
+                v = it % history_size
+                ok = delta >= 0 or score + delta >= history[v]
+            if ok:
+                accepted += 1
+                if delta < 0 and best is None:
+                    best = (seq.copy(), content.copy(), list(sets), list(sizes), trans.copy())
+                score += delta
+                if score > best_score:
+                    best_score, best = score, None
+                if kind == 0:
+                    trans[l:r] = trans[l:r][::-1].copy()
+                    seq[l:r+1] = seq[l:r+1][::-1].copy()
+                    pos[seq[l:r+1]] = np.arange(l, r + 1)
+                    if l > 0:
+                        trans[l-1] = new_left
+                    if r < last:
+                        trans[r] = new_right
+                elif kind == 1:
+                    if k > i:
+                        trans[i+2:k] = trans[i+1:k-1].copy()
+                        seq[i+2:k+1] = seq[i+1:k].copy()
+                        seq[i+1] = b
+                        lo, hi = i + 1, k
+                        if k < last:
+                            trans[k] = gap
+                        trans[i] = after_a
+                        if i + 1 < last:
+                            trans[i+1] = after_b
+                    else:
+                        trans[k:i-1] = trans[k+1:i].copy()
+                        seq[k:i] = seq[k+1:i+1].copy()
+                        seq[i] = b
+                        lo, hi = k, i
+                        if k > 0:
+                            trans[k-1] = gap
+                        trans[i-1] = after_a
+                        if i < last:
+                            trans[i] = after_b
+                    pos[seq[lo:hi+1]] = np.arange(lo, hi + 1)
+                else:
+                    content[a, 1], content[b, 0] = y2, y1
+                    content[b, 1] = x2
+                    sets[a], sets[b] = tags_a, tags_b
+                    sizes[a], sizes[b] = len(tags_a), len(tags_b)
+                    for e in {i - 1, i, k - 1, k}:
+                        if 0 <= e < last:
+                            trans[e] = self.score_ids(seq[e], seq[e+1])
+            if not annealing:
+                history[v] = score
+
+        if best is not None:
+            seq[:], content[:], sets[:], sizes[:], trans[:] = best
+            pos[seq] = np.arange(n)
+            score = best_score
+        self.score = int(score)
+
+        seconds = self.deadline.elapsed()
+        self.report = {
+            'method': method,
+            'initial_score': int(initial_score),
+            'score': self.score,
+            'iterations': it,
+            'accepted': accepted,
+            'seconds': seconds,
+            'moves_per_sec': it / seconds if seconds > 0 else 0.,
+        }
+        if verbose > 0:
+            print(f"{method} : {initial_score} -> {self.score} in {seconds:.2f} sec "
+                  f"({it} moves, {self.report['moves_per_sec']:.0f} moves/sec, {accepted} accepted)")
+        return self.report
+
+    def best_score(self):
+        return self.score
+
+    def get_slideshow(self):
+        ss = Slideshow()
+        for idx in self.sequence.tolist():
+            ss.add_right(Slide(*[self.dataset.get_photo(p) for p in self.content[idx].tolist() if p >= 0]))
+        return ss
+
+    def create_slideshow(self, initial=None, iterations=None, budget=None, method='annealing', **kwargs):
+        self.reset(initial)
+        self.search(iterations=iterations, budget=budget, method=method, **kwargs)
+        return self.get_slideshow()
+
+    def run(self, initial=None, iterations=None, budget=None, method='annealing', verbose=1, **kwargs):
+        slideshow = self.create_slideshow(initial=initial, iterations=iterations, budget=budget, method=method,
+                                          verbose=verbose, **kwargs)
+        score = score_slideshow(slideshow)
+        print(f'Score : {score}') if verbose > 0 else 0
+        return slideshow
+
+
+if __name__ == '__main__':
+    from algos.greedy import GreedySolution
+    filename = "data/c_memorable_moments.txt"
+    sol = AnnealingSolution(filename)
+    initial = GreedySolution().create_slideshow(sol.slides, max_candidates=100, store=sol.store)
+    slideshow = sol.run(initial=initial, budget=10, method='late_acceptance')
@@ -0,0 +1,122 @@
+from base import *
+from dataset import *
+from pairing import *
+from parallel import *
+from search import *
+from utils import *
+
+from tqdm import tqdm
+import numpy as np
+import random
+
+
+###########################################
+# Worker processes
+###########################################
+
+def _chunk_worker(args):
+    chunk, seed, kwargs = args
+    seed_worker(seed)
+    return get_worker_solution().solve_chunk(chunk, **kwargs)
+
+
+def tag_coherent_order(store, depth=3):
+    """ Order of the slides of a SlideStore in which slides sharing their most frequent tags are next to each other :
+    slides are sorted by their depth most frequent tags (lexicographically, the most frequent tag first).
+    :return: int array of slide indexes.
+    """
+    n = len(store)
+    freq = np.bincount(store.indices, minlength=store.num_tags)
+    rank = np.empty(store.num_tags, dtype=np.int64)
+    rank[np.argsort(-freq, kind='stable')] = np.arange(store.num_tags)
+
+    # Tags of every slide by decreasing frequency, the missing ones coming after all the others
+    positions, owners = csr_positions(store.indptr, np.arange(n))
+    ranks = rank[store.indices[positions]]
+    by_slide = np.lexsort((ranks, owners))
+    owners, ranks = owners[by_slide], ranks[by_slide]
+    k = np.arange(len(owners)) - store.indptr[owners]
+    keys = np.full((depth, n), store.num_tags, dtype=np.int64)
+    keys[k[k < depth], owners[k < depth]] = ranks[k < depth]
+    return np.lexsort(keys[::-1])
+
+
+class ChunkedSolution(AnytimeSearch):
+    """
+    Divide and conquer : the slides of the whole dataset are split into chunks of tag-coherent slides,
+    a solver arranges every chunk (in parallel with n_jobs > 1), then the sub-slideshows are stitched together.
+    The solver is any of the Monte Carlo solutions (NRPASolution, NestedMCSolution, UCT...) : it must provide
+    use_slides and report its solution in its incumbent (see search.AnytimeSearch).
+    """
+
+    def __init__(self, solver, chunk_size=200, n_jobs=1):
+        """
+        :param solver: Solver built on the dataset, whose create_slideshow is run on every chunk.
+        :param chunk_size: Number of slides of a chunk.
+        :param n_jobs: Number of worker processes solving chunks. The solver itself must then run in one process.
+        """
+        assert n_jobs <= 1 or getattr(solver, 'n_jobs', 1) <= 1, "Chunks are solved in parallel : use a solver with n_jobs=1."
+        self.solver = solver
+        self.slides = solver.slides
+        self.store = solver.store
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+        self.workers = None  # Process pool, only alive during create_slideshow
+
+    def chunks(self):
+        """ Consecutive slices of chunk_size slides of the tag-coherent order.
+        Within a chunk, slides are sorted by decreasing number of tags, as the solvers expect.
+        """
+        order = tag_coherent_order(self.store)
+        chunks = []
+        for start in range(0, len(order), self.chunk_size):
+            chunk = order[start:start+self.chunk_size]
+            chunks.append(chunk[np.argsort(-self.store.sizes[chunk], kind='stable')].tolist())
+        return chunks
+
+    @PROFILER.traced('chunked.solve_chunk')
+    def solve_chunk(self, chunk, **kwargs):
+        """ Runs the solver on the slides of chunk and returns the sequence of slide indexes it found. """
+        self.solver.use_slides(chunk)
+        self.solver.create_slideshow(**kwargs)
+        return self.solver.incumbent.sequence
+
+    def stitch(self, sequences):
+        """ Chains the sub-slideshows, each one (possibly reversed) after the one whose end makes the best
+        transition with it (see base.stitch_sequences).
+        :return: Sequence of slide indexes.
+        """
+        return stitch_sequences(self.store, sequences)
+
+    def create_slideshow(self, budget=None, **kwargs):
+        """ Solves every chunk with solver.create_slideshow(**kwargs) and stitches the results.
+        :param budget: Total time budget in seconds (None for no limit), shared evenly by the chunks.
+        """
+        self.start_search(budget)
+        chunks = self.chunks()
+        if budget is not None:
+            kwargs['budget'] = budget * max(self.n_jobs, 1) / len(chunks)
+        with worker_pool(self, self.n_jobs):
+            if self.workers is not None:
+                tasks = [(chunk, random.getrandbits(32), kwargs) for chunk in chunks]
+                sequences = self.workers.map(_chunk_worker, tasks)
+            else:
+                sequences = [self.solve_chunk(chunk, **kwargs) for chunk in tqdm(chunks, desc='Chunks')]
+        with PROFILER.span('chunked.stitch'):
+            sequence = self.stitch(sequences)
+        assert len(sequence) == len(self.slides)
+        self.incumbent.update(int(self.store.score_pairs(sequence[:-1], sequence[1:]).sum()), sequence)
+        return self.best_slideshow()
+
+    def run(self, verbose=1, budget=None, **kwargs):
+        slideshow = self.create_slideshow(budget=budget, **kwargs)
+        score = score_slideshow(slideshow)
+        print(f'Score : {score}') if verbose > 0 else 0
+        return slideshow
+
+
+if __name__ == '__main__':
+    from algos.nested import NestedMCSolution
+    filename = "data/d_pet_pictures.txt"
+    sol = ChunkedSolution(NestedMCSolution(filename, max_candidates=3), chunk_size=200)
+    slideshow = sol.run(n=1)
@@ -1,4 +1,6 @@
 from base import *
+from dataset import *
+from pairing import *
 from utils import *
 
 from tqdm import trange
@@ -11,28 +13,13 @@ import copy
 class GreedySolution:
 
     @timeit
-    def form_slides(self, photos):
-        # Naive algorithm where
-        # vertical photos are paired sequentially as they are read.
-        slides = []
-        remaining_vertical = None
-        for photo in photos:
-            if photo.is_vertical() and remaining_vertical is not None:
-                slide = Slide(remaining_vertical, photo)
-                slides.append(slide)
-                remaining_vertical = None
-            elif photo.is_vertical() and remaining_vertical is None:
-                remaining_vertical = photo
-            else:
-                # Photo is horizontal
-                slide = Slide(photo)
-                slides.append(slide)
-
-        assert remaining_vertical is None, f"One vertical photo remains... Kinda strange."
-        return slides
+    def form_slides(self, photos, pairing=DEFAULT_PAIRING):
+        return form_slides(photos, pairing=pairing)
 
-    def get_next_best_idx_slide(self, current_slide, sample_idx_slides, all_slides):
-        return max(sample_idx_slides, key=lambda x: score_slides(current_slide, all_slides[x]))
+    def get_next_best_idx_slide(self, current_idx_slide, sample_idx_slides, store):
+        # First best candidate, as max() would return
+        scores = store.score_many(current_idx_slide, sample_idx_slides)
+        return int(sample_idx_slides[int(np.argmax(scores))])
 
     def get_tag_to_idx_slides(self, slides):
         tag2idx_slides = {}
@@ -45,43 +32,179 @@ class GreedySolution:
 
     def get_candidate_idx_slides(self, sorted_idx_slides, max_candidates=1000):
         # Returning the longest
-        return sorted_idx_slides[:max_candidates]
+        return sorted_idx_slides.top(max_candidates)
+
+    def get_sharing_idx_slides(self, index, current_idx_slide, sorted_idx_slides, max_candidates=1000):
+        # Remaining slides sharing a tag with the current one, or the longest if there are none
+        candidates = index.candidates(current_idx_slide, max_candidates=max_candidates)
+        if len(candidates) == 0:
+            candidates = self.get_candidate_idx_slides(sorted_idx_slides, max_candidates=max_candidates)
+        return candidates
+
+    def get_end_candidates(self, index, idx_end, idx_slides, max_candidates=1000, graph=None, noise=0.):
+        # Best remaining successor of the end in the graph, else remaining slides sharing a tag with it
+        if graph is not None:
+            best_idx_slide = graph.best_available(idx_end, idx_slides, noise=noise)
+            if best_idx_slide is not None:
+                return [best_idx_slide]
+        return index.candidates(idx_end, max_candidates=max_candidates).tolist()
+
+    def grow_both_ends(self, src_slides, store, max_candidates=1000, graph=None, seeds=1, seed_idx=0, noise=0.,
+                       verbose=1, deadline=None):
+        """ Greedy growing slideshows by both ends : every slideshow starts from a seed slide (the first slide,
+        then random ones), and every step extends the end, among all the ends of all the slideshows, whose best
+        candidate scores the most. The best candidate of every end is kept until the end changes or the candidate
+        is used elsewhere : at every step, only these ends are scored, all together in one score_block.
+        The slideshows are finally chained (see stitch_sequences).
+        :param seeds: Number of slideshows grown at the same time.
+        :param seed_idx: Seed slide of the first slideshow.
+        :param noise: Successors in the graph are compared on their score plus a uniform noise in [0, noise).
+        :param deadline: search.Deadline, see construct.
+        :return: Slideshow
+        """
+        sorted_idx_slides = store.sorted_by_num_tags()
+        idx_slides = SlidePool(sorted_idx_slides)
+        index = InvertedIndex(store, order=sorted_idx_slides)
+
+        seed_idx_slides = [seed_idx] + idx_slides.sample(seeds - 1, exclude=seed_idx) if len(src_slides) > 0 else []
+        chains = []  # Slideshows grown together
+        for idx_slide in seed_idx_slides:
+            idx_slides.remove(idx_slide)
+            index.remove(idx_slide)
+            sh = Slideshow(src_slides)
+            sh.add_right_idx(idx_slide)
+            chains.append(sh)
+
+        best = {}  # (chain, side) -> (score, candidate or None), side 0 for the left end and 1 for the right one
+        num_random = 0
+        remaining = []  # Slides left when the deadline expires
+        t = trange(len(src_slides) - len(chains), desc='Bar desc', leave=True, disable=verbose < 1)
+        for _ in t:
+            if deadline is not None and deadline.expired():
+                # The remaining slides are chained with the slideshows, in the order of the pool
+                remaining = list(idx_slides)
+                break
+            stale = [(c, side) for c in range(len(chains)) for side in (0, 1)
+                     if (c, side) not in best or (best[c, side][1] is not None and best[c, side][1] not in idx_slides)]
+            if len(stale) > 0:
+                ends = [int(chains[c].indexes[-side]) for c, side in stale]
+                candidates = [self.get_end_candidates(index, idx_end, idx_slides, max_candidates=max_candidates,
+                                                      graph=graph, noise=noise) for idx_end in ends]
+                union = sorted(set().union(*candidates))
+                scores = store.score_block(ends, union) if len(union) > 0 else None
+                column = {idx_slide: j for j, idx_slide in enumerate(union)}
+                for row, (key, end_candidates) in enumerate(zip(stale, candidates)):
+                    if len(end_candidates) == 0:
+                        # No remaining slide shares a tag with this end, and none ever will
+                        best[key] = (-1, None)
+                        continue
+                    end_scores = scores[row, [column[idx_slide] for idx_slide in end_candidates]]
+                    j = int(np.argmax(end_scores))  # First best candidate
+                    best[key] = (int(end_scores[j]), end_candidates[j])
+
+            key = max(best, key=lambda k: best[k][0])
+            next_idx_slide = best[key][1]
+            if next_idx_slide is None:
+                # Choose randomly, at the right of the first slideshow
+                num_random += 1
+                next_idx_slide = idx_slides.sample()
+                key = (0, 1)
+            c, side = key
+            if side == 0:
+                chains[c].add_left_idx(next_idx_slide)
+            else:
+                chains[c].add_right_idx(next_idx_slide)
+            best.pop(key, None)
+            idx_slides.remove(next_idx_slide)
+            index.remove(next_idx_slide)
 
-    @timeit
-    def create_slideshow(self, src_slides, max_candidates=1000):
-        idx_slides = sorted(range(0, len(src_slides)), key=lambda x: -len(src_slides[x].get_tags()))
+        print(f'Num random : {num_random}/{len(src_slides)}') if verbose > 0 else 0
+        assert len(idx_slides) == len(remaining)
+        if len(chains) == 1 and len(remaining) == 0:
+            return chains[0]
+        sequences = [sh.indexes for sh in chains] + ([remaining] if len(remaining) > 0 else [])
+        return Slideshow.from_indexes(src_slides, stitch_sequences(store, sequences), store=store)
 
-        seed_idx = 0
-        seed = src_slides[seed_idx]
+    @timeit
+    def create_slideshow(self, src_slides, max_candidates=1000, store=None, graph=None, bidirectional=False,
+                         seeds=1, seed_idx=0, noise=0., verbose=1, deadline=None):
+        """
+        :param graph: knn.TransitionGraph of the slides. The next slide is then the best remaining successor
+        of the current one in the graph, which is the best remaining slide, and candidates are only scored once
+        all its successors are used.
+        :param bidirectional: If True, the slideshow grows by both ends (see grow_both_ends).
+        :param seeds: Number of slideshows grown at the same time by both ends, then chained.
+        :param seed_idx: First slide of the slideshow.
+        :param noise: Randomization of the greedy : successors in the graph are compared on their score plus
+        a uniform noise in [0, noise). Below 1, it only breaks ties at random, since scores are integers.
+        Candidates scored when the graph gives none are not randomized : the first best one has the most tags,
+        which leaves better transitions for the next steps (breaking these ties at random costs 0.7% on d).
+        :param verbose: 0 for no progress bar.
+        :param deadline: search.Deadline of the construction, None for no limit. Once it is expired, the remaining
+        slides are appended in the order of the pool (by decreasing number of tags) : the slideshow is complete.
+        """
+        return self.construct(src_slides, max_candidates=max_candidates, store=store, graph=graph,
+                              bidirectional=bidirectional, seeds=seeds, seed_idx=seed_idx, noise=noise,
+                              verbose=verbose, deadline=deadline)
+
+    def construct(self, src_slides, max_candidates=1000, store=None, graph=None, bidirectional=False, seeds=1,
+                  seed_idx=0, noise=0., verbose=1, deadline=None):
+        """ create_slideshow, without timing (e.g. for the many constructions of algos.multistart). """
+        store = SlideStore.from_slides(src_slides) if store is None else store
+        if bidirectional or seeds > 1:
+            return self.grow_both_ends(src_slides, store, max_candidates=max_candidates, graph=graph, seeds=seeds,
+                                       seed_idx=seed_idx, noise=noise, verbose=verbose, deadline=deadline)
+        sorted_idx_slides = store.sorted_by_num_tags()
+        idx_slides = SlidePool(sorted_idx_slides)
+        index = InvertedIndex(store, order=sorted_idx_slides)
+
+        next_idx_slide = seed_idx
         idx_slides.remove(seed_idx)
+        index.remove(seed_idx)
 
-        sh = Slideshow()
-        sh.add_right(seed)
+        sh = Slideshow(src_slides)
+        sh.add_right_idx(seed_idx)
 
         num_random = 0
-        t = trange(len(src_slides) - 1, desc='Bar desc', leave=True)
+        remaining = []  # Slides left when the deadline expires
+        t = trange(len(src_slides) - 1, desc='Bar desc', leave=True, disable=verbose < 1)
         for _ in t:
-            sample_idx_slides = self.get_candidate_idx_slides(list(idx_slides), max_candidates=max_candidates)
-            if len(sample_idx_slides) > 0:
-                next_idx_slide = self.get_next_best_idx_slide(sh.get_last(), sample_idx_slides, src_slides)
+            if deadline is not None and deadline.expired():
+                # The remaining slides are appended in the order of the pool, all scored at once
+                remaining = list(idx_slides)
+                break
+            best_idx_slide = graph.best_available(next_idx_slide, idx_slides, noise=noise) if graph is not None else None
+            if best_idx_slide is not None:
+                next_idx_slide = best_idx_slide
             else:
-                # Choose randomly
-                num_random += 1
-                next_idx_slide = random.choice(list(idx_slides))
-            next_slide = src_slides[next_idx_slide]
+                sample_idx_slides = self.get_sharing_idx_slides(index, next_idx_slide, idx_slides,
+                                                                max_candidates=max_candidates)
+                if len(sample_idx_slides) > 0:
+                    next_idx_slide = self.get_next_best_idx_slide(next_idx_slide, sample_idx_slides, store)
+                else:
+                    # Choose randomly
+                    num_random += 1
+                    next_idx_slide = idx_slides.sample()
             idx_slides.remove(next_idx_slide)
-            sh.add_right(next_slide)
+            index.remove(next_idx_slide)
+            sh.add_right_idx(next_idx_slide)
 
-        print(f'Num random : {num_random}/{len(src_slides)}')
-        assert len(idx_slides) == 0
+        print(f'Num random : {num_random}/{len(src_slides)}') if verbose > 0 else 0
+        assert len(idx_slides) == len(remaining)
+        if len(remaining) > 0:
+            return Slideshow.from_indexes(src_slides, sh.indexes.tolist() + remaining, store=store)
         return sh
 
-    def run(self, filename, max_candidates=100):
-        photos = load_data(filename)
-        slides = self.form_slides(photos)
-        del photos
+    def run(self, filename, max_candidates=100, pairing=DEFAULT_PAIRING, knn=DEFAULT_K, bidirectional=False, seeds=1):
+        """
+        :param knn: Number of successors of every slide in the transition graph, 0 not to use the graph.
+        """
+        dataset = load_dataset(filename, pairing=pairing)
+        slides = dataset.slides
         print(f'Num slides : {len(slides)}')
-        slideshow = self.create_slideshow(slides, max_candidates=max_candidates)
+        graph = dataset.transition_graph(k=knn) if knn > 0 else None
+        slideshow = self.create_slideshow(slides, max_candidates=max_candidates, store=dataset.store, graph=graph,
+                                          bidirectional=bidirectional, seeds=seeds)
         score = score_slideshow(slideshow)
         print(f'Score : {score}')
         return slideshow
@@ -0,0 +1,239 @@
+from base import *
+from dataset import *
+from pairing import *
+from search import *
+from utils import *
+
+import numpy as np
+import random
+
+
+class LocalSearch(AnytimeSearch):
+    """
+    Post-optimization of a slideshow by hill climbing : random moves are drawn and kept if they improve the score.
+    Moves :
+    - 'reverse' : reverses a segment (2-opt), so that two slides sharing tags become neighbors,
+    - 'relocate' : moves a slide next to a slide sharing tags with it (or-opt),
+    - 'swap' : exchanges the slide following a slide with a slide sharing tags with it,
+    - 'repair' : exchanges vertical photos between two vertical slides.
+    A move only changes a few transitions : it is evaluated by scoring those with score_slides, in O(1).
+    Candidate neighbors are drawn from the tag index : slides sharing a tag with the slide being improved.
+    """
+
+    MOVES = ('reverse', 'relocate', 'swap', 'repair')
+
+    def __init__(self, slideshow, moves=MOVES):
+        """
+        :param slideshow: Slideshow to improve. It is left unchanged.
+        :param moves: Names of the moves to use.
+        """
+        assert all(m in self.MOVES for m in moves), f"Unknown move in {moves}, expected some of {self.MOVES}."
+        self.moves = list(moves)
+        # Slides are designated by ids : their positions in the initial slideshow
+        self.slides = list(slideshow.get_slides())
+        self.sequence = np.arange(len(self.slides))  # position -> id
+        self.position = np.arange(len(self.slides))  # id -> position
+        self.tags = [tuple(slide.get_tags()) for slide in self.slides]
+        self.postings = {}  # tag -> ids of the slides having it (ids may be stale after re-pairings)
+        for idx, tags in enumerate(self.tags):
+            for tag in tags:
+                self.postings.setdefault(tag, []).append(idx)
+        self.score = score_slideshow(slideshow) if len(slideshow) > 0 else 0
+        self.stats = {m: {'tried': 0, 'improved': 0, 'gain': 0} for m in self.moves}
+
+    def slide_at(self, p):
+        return self.slides[self.sequence[p]]
+
+    def transition(self, p):
+        """ Score of the transition between positions p and p + 1 (0 outside of the slideshow). """
+        if p < 0 or p + 1 >= len(self.sequence):
+            return 0
+        return score_slides(self.slide_at(p), self.slide_at(p+1))
+
+    def neighbor(self, idx, sample_size=8):
+        """ Among sample_size random slides sharing a tag with slide idx, the best transition from it.
+        None if none was found.
+        """
+        tags = self.tags[idx]
+        if len(tags) == 0:
+            return None
+        slide = self.slides[idx]
+        best, best_score = None, -1
+        for _ in range(sample_size):
+            other = random.choice(self.postings[random.choice(tags)])
+            if other == idx:
+                continue
+            score = score_slides(slide, self.slides[other])
+            if score > best_score:
+                best, best_score = other, score
+        return best
+
+    def _local_score(self, positions, replaced=None):
+        """ Sum of the transitions touching positions, where replaced maps positions to the slide they would hold. """
+        replaced = {} if replaced is None else replaced
+        n = len(self.sequence)
+        edges = {e for p in positions for e in (p - 1, p) if 0 <= e < n - 1}
+        total = 0
+        for e in edges:
+            left = replaced[e] if e in replaced else self.slide_at(e)
+            right = replaced[e + 1] if e + 1 in replaced else self.slide_at(e + 1)
+            total += score_slides(left, right)
+        return total
+
+    ###########################################
+    # Moves : every one returns (delta, apply) or None
+    ###########################################
+
+    def move_reverse(self, i, j):
+        # Makes the slides at positions i and j neighbors by reversing the segment between them
+        l, r = (i + 1, j) if i < j else (j, i - 1)
+        if l >= r:
+            return None
+        s = self.slide_at
+        n = len(self.sequence)
+        before = self.transition(l - 1) + self.transition(r)
+        after = (score_slides(s(l - 1), s(r)) if l > 0 else 0) + (score_slides(s(l), s(r + 1)) if r + 1 < n else 0)
+
+        def apply():
+            segment = self.sequence[l:r+1][::-1].copy()
+            self.sequence[l:r+1] = segment
+            self.position[segment] = np.arange(l, r + 1)
+        return after - before, apply
+
+    def move_relocate(self, i, k):
+        # Moves the slide at position k right after the one at position i
+        if k == i + 1:
+            return None
+        s = self.slide_at
+        n = len(self.sequence)
+        moved = s(k)
+        delta = -self.transition(k - 1) - self.transition(k)
+        delta += score_slides(s(k - 1), s(k + 1)) if 0 < k < n - 1 else 0
+        delta += -self.transition(i) + score_slides(s(i), moved)
+        delta += score_slides(moved, s(i + 1)) if i + 1 < n else 0
+
+        def apply():
+            idx = self.sequence[k]
+            if k > i:
+                self.sequence[i+2:k+1] = self.sequence[i+1:k].copy()
+                self.sequence[i+1] = idx
+                lo, hi = i + 1, k
+            else:
+                self.sequence[k:i] = self.sequence[k+1:i+1].copy()
+                self.sequence[i] = idx
+                lo, hi = k, i
+            self.position[self.sequence[lo:hi+1]] = np.arange(lo, hi + 1)
+        return delta, apply
+
+    def move_swap(self, i, k):
+        # Exchanges the slide at position i + 1 with the one at position k
+        j = i + 1
+        if j >= len(self.sequence) or j == k:
+            return None
+        positions = (j, k)
+        before = self._local_score(positions)
+        after = self._local_score(positions, {j: self.slide_at(k), k: self.slide_at(j)})
+
+        def apply():
+            a, b = self.sequence[j], self.sequence[k]
+            self.sequence[j], self.sequence[k] = b, a
+            self.position[a], self.position[b] = k, j
+        return after - before, apply
+
+    def move_repair(self, p, q):
+        # Exchanges one vertical photo of the slide at position p with one of the slide at position q
+        slide_p, slide_q = self.slide_at(p), self.slide_at(q)
+        if p == q or not (slide_p.has_vertical() and slide_q.has_vertical()):
+            return None
+        (x1, x2), (y1, y2) = slide_p.get_content(), slide_q.get_content()
+        new_p, new_q = (Slide(x1, y2), Slide(y1, x2)) if random.random() < 0.5 else (Slide(x1, y1), Slide(x2, y2))
+        positions = (p, q)
+        before = self._local_score(positions)
+        after = self._local_score(positions, {p: new_p, q: new_q})
+
+        def apply():
+            for pos, slide in ((p, new_p), (q, new_q)):
+                idx = self.sequence[pos]
+                self.slides[idx] = slide
+                self.tags[idx] = tuple(slide.get_tags())
+                for tag in self.tags[idx]:
+                    # Postings only grow : a stale id is still a valid (if worse) candidate
+                    posting = self.postings.setdefault(tag, [])
+                    if len(posting) == 0 or posting[-1] != idx:
+                        posting.append(idx)
+        return after - before, apply
+
+    ###########################################
+    # Search
+    ###########################################
+
+    def step(self):
+        """ Draws one move around a random position and applies it if it improves the score.
+        :return: (name of the move, gain), the gain being 0 if the move was not applied.
+        """
+        n = len(self.sequence)
+        name = random.choice(self.moves)
+        i = random.randrange(n)
+        other = self.neighbor(self.sequence[i])
+        if other is None:
+            return name, 0
+        k = self.position[other]
+        result = getattr(self, 'move_' + name)(i, k)
+        self.stats[name]['tried'] += 1
+        if result is None or result[0] <= 0:
+            return name, 0
+        delta, apply = result
+        apply()
+        self.score += delta
+        self.stats[name]['improved'] += 1
+        self.stats[name]['gain'] += delta
+        return name, delta
+
+    def best_score(self):
+        return self.score
+
+    @PROFILER.traced('local_search.improve')
+    def improve(self, budget=None, max_iters=None, verbose=1):
+        """ Hill climbing until the budget (seconds) or max_iters moves are spent. At least one must be given.
+        :return: Report of the run (dict), also kept in self.report.
+        """
+        assert budget is not None or max_iters is not None, "Give a time budget or a number of iterations."
+        self.start_search(budget)
+        initial_score = self.score
+        iters = 0
+        if len(self.sequence) > 1:
+            while not self.expired() and (max_iters is None or iters < max_iters):
+                self.step()
+                iters += 1
+        seconds = self.deadline.elapsed()
+        self.report = {
+            'initial_score': int(initial_score),
+            'score': int(self.score),
+            'iterations': iters,
+            'seconds': seconds,
+            'improvement_per_sec': (self.score - initial_score) / seconds if seconds > 0 else 0.,
+            'moves': {m: dict(v) for m, v in self.stats.items()},
+        }
+        if verbose > 0:
+            print(f"Score : {initial_score} -> {self.score} in {seconds:.2f} sec "
+                  f"({self.report['improvement_per_sec']:.1f} points/sec, {iters} moves)")
+            for m, v in self.stats.items():
+                print(f"  {m} : {v['improved']}/{v['tried']} improving moves, +{v['gain']}")
+        return self.report
+
+    def get_slideshow(self):
+        return Slideshow.from_indexes(self.slides, self.sequence)
+
+
+def improve_slideshow(slideshow, budget=None, max_iters=None, moves=LocalSearch.MOVES, verbose=1):
+    """ Improves slideshow by local search (see LocalSearch) and returns the improved slideshow. """
+    search = LocalSearch(slideshow, moves=moves)
+    search.improve(budget=budget, max_iters=max_iters, verbose=verbose)
+    return search.get_slideshow()
+
+
+if __name__ == '__main__':
+    from algos.greedy import GreedySolution
+    filename = "data/c_memorable_moments.txt"
+    slideshow = GreedySolution().run(filename, 100)
+    slideshow = improve_slideshow(slideshow, budget=10)
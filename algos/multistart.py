@@ -0,0 +1,143 @@
+from algos.greedy import GreedySolution
+from base import *
+from dataset import *
+from pairing import *
+from parallel import *
+from search import *
+from utils import *
+
+import numpy as np
+import random
+import time
+
+
+###########################################
+# Worker processes
+###########################################
+
+def _starts_worker(args):
+    seed, num_starts, first = args
+    seed_worker(seed)
+    return get_worker_solution().run_starts(num_starts, first=first)
+
+
+class MultiStartGreedy(AnytimeSearch):
+    """
+    Multi-start greedy : many randomized greedy constructions (see GreedySolution.construct), the best one is kept.
+    Every start compares the successors of the transition graph on their score plus a uniform noise,
+    which breaks ties at random (noise < 1) or also lets slightly worse successors win (noise >= 1),
+    and may begin with a random slide instead of the one with the most tags.
+    The very first start is the plain greedy (no noise, no random slide) : the result is never worse than it.
+    With n_jobs > 1, the starts run in forked worker processes sharing the memory-mapped slides and transition graph.
+    Starts run until num_starts are done or the budget is over : a start is only begun if it is expected
+    to end within the budget, and a start still running when the budget is over is completed with the remaining
+    slides in the order of the pool (see GreedySolution.construct). Its score is part of the distribution.
+    """
+
+    def __init__(self, filename, max_candidates=100, pairing=DEFAULT_PAIRING, knn=DEFAULT_K, noise=0.5,
+                 random_seed=False, bidirectional=False, seeds=1, n_jobs=1):
+        """
+        :param max_candidates: Number of candidates scored by the greedy when the transition graph gives none.
+        :param knn: Number of successors of every slide in the transition graph, 0 not to use the graph
+        (the starts then only differ by their first slide, or their seeds).
+        :param noise: Uniform noise in [0, noise) added to the scores of the successors.
+        :param random_seed: If True, every start (but the first one) begins with a random slide. On d,
+        these starts score about 0.6% less than the ones beginning with the slide with the most tags.
+        :param bidirectional: If True, slideshows grow by both ends (see GreedySolution.grow_both_ends).
+        :param seeds: Number of slideshows grown at the same time by both ends, then chained.
+        :param n_jobs: Number of worker processes.
+        """
+        self.dataset = load_dataset(filename, pairing=pairing)
+        self.slides = self.dataset.slides
+        print(f'Num slides : {len(self.slides)}')
+        self.store = self.dataset.store
+        self.graph = self.dataset.transition_graph(k=knn) if knn > 0 else None
+        self.greedy = GreedySolution()
+        self.max_candidates = max_candidates
+        self.noise = noise
+        self.random_seed = random_seed
+        self.bidirectional = bidirectional
+        self.seeds = seeds
+        self.n_jobs = n_jobs
+        self.scores = []  # Scores of all the starts of the last search
+        self.workers = None  # Process pool, only alive during create_slideshow
+
+    def start(self, plain=False):
+        """ One greedy construction, the plain greedy if plain is True.
+        :return: Slideshow
+        """
+        if PROFILER.enabled:
+            PROFILER.count('starts')
+        seed_idx = random.randrange(len(self.slides)) if self.random_seed and not plain else 0
+        return self.greedy.construct(self.slides, max_candidates=self.max_candidates, store=self.store,
+                                     graph=self.graph, bidirectional=self.bidirectional, seeds=self.seeds,
+                                     seed_idx=seed_idx, noise=0. if plain else self.noise, verbose=0,
+                                     deadline=self.deadline)
+
+    def run_starts(self, num_starts=None, first=False):
+        """ Runs starts until num_starts are done or the deadline is close (see MultiStartGreedy).
+        :param num_starts: Maximum number of starts, None for no limit.
+        :param first: If True, the first start is the plain greedy.
+        :return: (scores of the starts, sequence of slide indexes of the best one)
+        """
+        scores, best_score, best_sequence = [], float('-inf'), None
+        durations = []
+        while num_starts is None or len(scores) < num_starts:
+            # The first start always runs, the next ones only if they should end within the budget
+            if len(scores) > 0 and self.deadline.remaining() < np.mean(durations):
+                break
+            ts = time.perf_counter()
+            slideshow = self.start(plain=first and len(scores) == 0)
+            durations.append(time.perf_counter() - ts)
+            scores.append(slideshow.score())
+            if scores[-1] > best_score:
+                best_score, best_sequence = scores[-1], slideshow.indexes.tolist()
+        return scores, best_sequence
+
+    @timeit
+    def create_slideshow(self, num_starts=None, budget=None):
+        """
+        :param num_starts: Total number of starts, None for no limit (a budget is then required).
+        :param budget: Time budget in seconds (None for no limit). It holds even if a single start takes longer :
+        the first start is then cut short (see MultiStartGreedy) and scores less than the plain greedy.
+        """
+        assert num_starts is not None or budget is not None, 'Give a number of starts or a budget.'
+        assert num_starts is None or num_starts >= 1, 'At least one start is needed.'
+        self.start_search(budget)
+        n_jobs = max(min(self.n_jobs, num_starts if num_starts is not None else self.n_jobs), 1)
+        # Starts of every worker
+        quotas = [None] * n_jobs if num_starts is None else \
+            [num_starts // n_jobs + (i < num_starts % n_jobs) for i in range(n_jobs)]
+        with PROFILER.span('multistart.search', n_jobs=n_jobs), worker_pool(self, n_jobs):
+            if self.workers is not None:
+                tasks = [(random.getrandbits(32), quota, i == 0) for i, quota in enumerate(quotas)]
+                results = self.workers.map(_starts_worker, tasks)
+            else:
+                results = [self.run_starts(quotas[0], first=True)]
+        self.scores = []
+        for scores, sequence in results:
+            self.scores += scores
+            self.incumbent.update(max(scores), sequence)
+        return self.best_slideshow()
+
+    def score_distribution(self):
+        """ Statistics of the scores of the starts of the last search. """
+        scores = np.array(self.scores)
+        return {'starts': len(scores), 'min': int(scores.min()), 'mean': float(scores.mean()),
+                'median': float(np.median(scores)), 'max': int(scores.max()), 'std': float(scores.std())}
+
+    def run(self, num_starts=None, budget=None, verbose=1):
+        slideshow = self.create_slideshow(num_starts=num_starts, budget=budget)
+        score = score_slideshow(slideshow)
+        if verbose > 0:
+            stats = self.score_distribution()
+            print(f"Starts : {stats['starts']}  min {stats['min']}  mean {stats['mean']:.1f}  "
+                  f"median {stats['median']:.1f}  max {stats['max']}  std {stats['std']:.1f}")
+            print(f'Score : {score}')
+        return slideshow
+
+
+if __name__ == '__main__':
+    filename = "data/c_memorable_moments.txt"
+    sol = MultiStartGreedy(filename, n_jobs=4)
+    slideshow = sol.run(num_starts=16, budget=60)
@@ -1,4 +1,7 @@
 from base import *
+from dataset import *
+from pairing import *
+from search import *
 from utils import *
 
 from tqdm import trange
@@ -8,82 +11,114 @@ import random
 import copy
 
 
-class NestedMCSolution:
+class NestedMCSolution(AnytimeSearch):
 
-    def __init__(self, filename, max_slides=200, max_candidates=3):
-        photos = load_data(filename)
-        self.slides = self.form_slides(photos)
+    def __init__(self, filename, max_slides=200, max_candidates=3, pairing=DEFAULT_PAIRING, knn=DEFAULT_K):
+        """
+        :param knn: Number of successors of every slide in the transition graph (see knn.TransitionGraph) :
+        the legal moves are the best remaining successors of the last slide. 0 for the first remaining slides
+        by number of tags.
+        """
+        self.dataset = load_dataset(filename, pairing=pairing)
+        self.slides = self.dataset.slides
         print(f'Num slides : {len(self.slides)}')
-        self.slides_ids = sorted(range(len(self.slides[:max_slides])), key=lambda x: -len(self.slides[x].get_tags()))
+        self.store = self.dataset.store
+        self.knn = knn
+        self.use_slides(self.store.sorted_by_num_tags(max_slides))
+        self.transitions = TransitionCache(self.slides)
         self.max_candidates = max_candidates
 
+    def use_slides(self, slide_ids):
+        """ Sets the slides to arrange, as indexes in self.slides (e.g. one chunk of the dataset). """
+        self.slides_ids = list(slide_ids)
+        self.pool = SlidePool(self.slides_ids)
+        # Legal moves are drawn from the transition graph of the slides, if there is one
+        self.graph = self.dataset.transition_graph(k=self.knn, slide_ids=self.slides_ids) if self.knn > 0 else None
+
     @timeit
-    def form_slides(self, photos):
-        # Naive algorithm where
-        # vertical photos are paired sequentially as they are read.
-        slides = []
-        remaining_vertical = None
-        for photo in photos:
-            if photo.is_vertical() and remaining_vertical is not None:
-                slide = Slide(remaining_vertical, photo)
-                slides.append(slide)
-                remaining_vertical = None
-            elif photo.is_vertical() and remaining_vertical is None:
-                remaining_vertical = photo
-            else:
-                # Photo is horizontal
-                slide = Slide(photo)
-                slides.append(slide)
-        assert remaining_vertical is None, f"One vertical photo remains... Kinda strange."
-        return slides
+    def form_slides(self, photos, pairing=DEFAULT_PAIRING):
+        return form_slides(photos, pairing=pairing)
 
     def legal_moves(self, state):
-        return state[1][:self.max_candidates]
+        if self.graph is not None:
+            return self.graph.legal_moves(state.sequence[-1] if len(state) > 0 else None, state.pool,
+                                          self.max_candidates)
+        return state.pool.top(self.max_candidates)
 
     def terminal(self, slideshow):
         return len(slideshow) == len(self.slides_ids)
 
     def play(self, state, move):
-        assert move in state[1]
-        if len(state[0]) > 0:
-            s = score_slides(self.slides[state[0][-1]], self.slides[move]) + state[2]
-        else:
-            s = 0
-        state[0].append(move)
-        state[1].remove(move)
-        return state[0], state[1], s
+        state.play(move)
+        return state
 
     def playout(self, state):
-        while len(state[1]) > 0:
-            moves = self.legal_moves(state)
-            move = random.choice(moves)
-            state = self.play(state, move)
-        return state
+        """ Random playout from state. Returns (score, sequence) and leaves state unchanged.
+        Without a transition graph, the pool is only read : the legal moves are a window sliding over its linked list.
+        """
+        if PROFILER.enabled:
+            PROFILER.count('rollouts')
+        pool, score_transition = state.pool, self.transitions.score
+        if self.graph is not None:
+            last = state.sequence[-1] if len(state) > 0 else None
+            score, moves = self.graph.playout(last, pool, self.max_candidates, score_transition)
+            return state.score + score, state.sequence + moves
+        window = self.legal_moves(state)
+        cursor = pool.next[window[-1]] if len(window) > 0 else pool.head
+        sequence, score = state.sequence[:], state.score
+        while len(window) > 0:
+            move = window.pop(random.randrange(len(window)))
+            if cursor != pool.head:
+                window.append(cursor)
+                cursor = pool.next[cursor]
+            score += score_transition(sequence[-1], move) if len(sequence) > 0 else 0
+            sequence.append(move)
+        return score, sequence
 
     def nested(self, state, n):
+        """ Nested Monte Carlo search at level n from state.
+        Moves are explored in place with play / undo, state is left unchanged.
+        The deadline is checked after every move tried at every level : once it is expired, every level
+        returns the best slideshow it has found so far, which is complete.
+        :return: (score, sequence) of the best complete slideshow found.
+        """
         if n == 0:
             return self.playout(state)
-        best_ending_state = (None, None, -1)
-        while not self.terminal(state[0]):
+        start = len(state)
+        best_score, best_sequence = -1, None
+        while not self.terminal(state.sequence):
             moves = self.legal_moves(state)
             for m in moves:
-                s1 = copy.deepcopy(state)
-                s1 = self.play(s1, m)
-                s1 = self.nested(s1, n - 1)
-                if s1[-1] > best_ending_state[-1]:
-                    best_ending_state = s1
-            state = self.play(state, best_ending_state[0][len(state[0])])
-        return state
+                self.play(state, m)
+                score, sequence = self.nested(state, n - 1)
+                state.undo()
+                if score > best_score:
+                    best_score, best_sequence = score, sequence
+                    self.incumbent.update(score, sequence)
+                if self.expired():
+                    break
+            if self.expired():
+                # best_sequence goes through the moves played so far : it is the best completion of them
+                break
+            self.play(state, best_sequence[len(state)])
+        if best_sequence is None:
+            best_score, best_sequence = state.score, state.sequence[:]
+        state.undo_to(start)
+        return best_score, best_sequence
 
-    def create_slideshow(self, n):
-        state = ([], self.slides_ids[:], 0)
-        final_state = self.nested(state, n)
-        ss = Slideshow()
-        [ss.add_right(self.slides[s]) for s in final_state[0]]
-        return ss
+    def create_slideshow(self, n, budget=None):
+        """
+        :param budget: Time budget in seconds (None for no limit). When it is over, the best slideshow found
+        so far is returned.
+        """
+        self.start_search(budget)
+        state = SearchState(self.pool.copy(), self.transitions)
+        with PROFILER.span('nested.search', level=n):
+            self.incumbent.update(*self.nested(state, n))
+        return self.best_slideshow()
 
-    def run(self, n, verbose=1):
-        slideshow = self.create_slideshow(n)
+    def run(self, n, verbose=1, budget=None):
+        slideshow = self.create_slideshow(n, budget=budget)
         score = score_slideshow(slideshow)
         print(f'Score : {score}') if verbose > 0 else 0
         return slideshow
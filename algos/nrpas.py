@@ -1,47 +1,69 @@
 from base import *
+from dataset import *
+from pairing import *
+from parallel import *
+from policy import *
+from search import *
 from utils import *
 
 from tqdm import trange
 from tqdm import tqdm
 import numpy as np
 import random
-from math import exp
 import copy
 
 
-class NRPASolution:
+###########################################
+# Worker processes
+###########################################
 
-    def __init__(self, filename, max_slides=200, max_candidates=3, N=40, P=10):
-        photos = load_data(filename)
-        self.slides = self.form_slides(photos)
+def _playouts_worker(args):
+    policy, num_playouts, seed = args
+    seed_worker(seed)
+    return get_worker_solution().playouts(policy, num_playouts)
+
+
+def _search_worker(args):
+    n, stabilized, seed = args
+    seed_worker(seed)
+    solution = get_worker_solution()
+    return solution.search(n, solution.initial_policy(), stabilized=stabilized)
+
+
+class NRPASolution(AnytimeSearch):
+
+    def __init__(self, filename, max_slides=200, max_candidates=3, N=40, P=10, pairing=DEFAULT_PAIRING, n_jobs=1,
+                 knn=DEFAULT_K):
+        self.dataset = load_dataset(filename, pairing=pairing)
+        self.slides = self.dataset.slides
         print(f'Num slides : {len(self.slides)}')
-        self.slides_ids = sorted(range(len(self.slides[:max_slides])), key=lambda x: -len(self.slides[x].get_tags()))
+        self.store = self.dataset.store
+        self.knn = knn  # Number of successors of every slide in the transition graph, 0 not to use it
+        self.use_slides(self.store.sorted_by_num_tags(max_slides))
+        self.transitions = TransitionCache(self.slides)
         self.max_candidates = max_candidates
         self.N = N 
         self.P = P
+        self.n_jobs = n_jobs
+        self.workers = None  # Process pool, only alive during create_slideshow
+
+    def use_slides(self, slide_ids):
+        """ Sets the slides to arrange, as indexes in self.slides (e.g. one chunk of the dataset). """
+        self.slides_ids = list(slide_ids)
+        self.pool = SlidePool(self.slides_ids)
+        # Moves are coded by their position in slides_ids : policies only hold the weights of these slides
+        self.codes = {idx_slide: i for i, idx_slide in enumerate(self.slides_ids)}
+        # Legal moves are drawn from the transition graph of the slides, if there is one
+        self.graph = self.dataset.transition_graph(k=self.knn, slide_ids=self.slides_ids) if self.knn > 0 else None
 
     @timeit
-    def form_slides(self, photos):
-        # Naive algorithm where
-        # vertical photos are paired sequentially as they are read.
-        slides = []
-        remaining_vertical = None
-        for photo in photos:
-            if photo.is_vertical() and remaining_vertical is not None:
-                slide = Slide(remaining_vertical, photo)
-                slides.append(slide)
-                remaining_vertical = None
-            elif photo.is_vertical() and remaining_vertical is None:
-                remaining_vertical = photo
-            else:
-                # Photo is horizontal
-                slide = Slide(photo)
-                slides.append(slide)
-        assert remaining_vertical is None, f"One vertical photo remains... Kinda strange."
-        return slides
+    def form_slides(self, photos, pairing=DEFAULT_PAIRING):
+        return form_slides(photos, pairing=pairing)
 
     def legal_moves(self, state):
-        return state[1][:self.max_candidates]
+        if self.graph is not None:
+            return self.graph.legal_moves(state[0][-1] if len(state[0]) > 0 else None, state[1], self.max_candidates)
+        return state[1].top(self.max_candidates)
 
     def terminal(self, slideshow):
         return len(slideshow) == len(self.slides_ids)
@@ -49,7 +71,7 @@ class NRPASolution:
     def play(self, state, move):
         assert move in state[1]
         if len(state[0]) > 0:
-            s = score_slides(self.slides[state[0][-1]], self.slides[move]) + state[2]
+            s = self.transitions.score(state[0][-1], move) + state[2]
         else:
             s = 0
         state[0].append(move)
@@ -57,6 +79,8 @@ class NRPASolution:
         return state[0], state[1], s
 
     def playout(self, state, policy="Uniform"):
+         if PROFILER.enabled:
+             PROFILER.count('rollouts')
          while len(state[1]) > 0:
              moves = self.legal_moves(state)
              move = random.choice(moves)
@@ -64,25 +88,42 @@ class NRPASolution:
          return state
 
     def code(self, move):
-        return move # move is already coded as an index on the slides so the function is idempotent
+        return self.codes[move]
 
     def playout_nrpa(self, state, policy):
+        if PROFILER.enabled:
+            PROFILER.count('rollouts')
         sequence = []
-        while len(state[1]) > 0:
-            z=0.0
+        codes = self.codes
+        # The Gumbel noise of the whole playout is drawn at once
+        for g in np.random.gumbel(size=(len(state[1]), self.max_candidates)):
             moves = self.legal_moves(state)
-            for m in moves:
-                z=z+exp(policy[self.code(m)])
-            move = random.choices(moves, weights=[exp(policy[self.code(m)])/z for m in moves])[0]
+            # The code of a move is its position in slides_ids
+            move = self.slides_ids[policy.sample([codes[m] for m in moves], noise=g)]
             state = self.play(state, move)
             sequence.append(move)
-        ss = Slideshow()
-        [ss.add_right(self.slides[s]) for s in state[0]]
-        return score_slideshow(ss), sequence
+        # The score is accumulated move after move by play
+        return state[2], sequence
+
+    def playouts(self, policy, num_playouts):
+        """ Best of num_playouts playouts with the same policy, fewer if the deadline expires.
+        :return: (score, sequence)
+        """
+        bestScore, bestSeq = float('-inf'), []
+        for _ in range(num_playouts):
+            score, seq = self.playout_nrpa(([], self.pool.copy(), 0), policy)
+            if score > bestScore:
+                bestScore, bestSeq = score, seq
+            if self.expired():
+                break
+        return bestScore, bestSeq
 
     def nrpa(self, n, policy):
+        """ NRPA at level n. The deadline is checked after every iteration of every level : once it is expired,
+        every level returns the best sequence it has found so far.
+        """
         if n == 0:
-            root = ([], self.slides_ids[:], 0) 
+            root = ([], self.pool.copy(), 0) 
             return self.playout_nrpa(root, policy)
         else:
             bestScore = float('-inf')
@@ -92,21 +133,34 @@ class NRPASolution:
                 if score > bestScore:
                     bestScore = score
                     bestSeq = seq
+                    self.incumbent.update(score, seq)
+                if self.expired():
+                    break
                 policy = self.adapt(policy, bestSeq)
             return (bestScore, bestSeq)
 
     def stabilizedNrpa(self, n, policy):
         if n == 0:
-            root = ([], self.slides_ids[:], 0) 
+            root = ([], self.pool.copy(), 0) 
             return self.playout_nrpa(root, policy)
         elif n==1:
             bestScore = float('-inf')
             bestSeq = []
-            for _ in range(self.P):
-                score, seq = self.stabilizedNrpa(n-1, policy)
+            if self.workers is not None:
+                # The P playouts share a fixed policy : every worker gets it once, with its share of the playouts
+                num_tasks = min(self.n_jobs, self.P)
+                tasks = [(policy, self.P // num_tasks + (i < self.P % num_tasks), random.getrandbits(32))
+                         for i in range(num_tasks)]
+                results = self.workers.map(_playouts_worker, tasks)
+            else:
+                results = (self.stabilizedNrpa(n-1, policy) for _ in range(self.P))
+            for score, seq in results:
                 if score > bestScore:
                     bestScore = score
                     bestSeq = seq
+                    self.incumbent.update(score, seq)
+                if self.expired():
+                    break
             return (bestScore, bestSeq)
         else:
             bestScore = float('-inf')
@@ -116,38 +170,60 @@ class NRPASolution:
                 if score > bestScore:
                     bestScore = score
                     bestSeq = seq
+                    self.incumbent.update(score, seq)
+                if self.expired():
+                    break
                 policy = self.adapt(policy, bestSeq)
             return (bestScore, bestSeq)
 
     def adapt(self, policy, sequence, alpha=1.0):
-        root = ([], self.slides_ids[:], 0) 
-        newPolicy = policy
-        state = root
+        # Replay the sequence to know the legal moves at every step, then update the policy at once
+        state = ([], self.pool.copy(), 0)
+        legal_codes = []
         for move in sequence:
-            newPolicy[self.code(move)]+=alpha
-            z=0.0
-            for m in self.legal_moves(state):
-                z+=exp(policy[self.code(m)])
-            for m in self.legal_moves(state):
-                newPolicy[self.code(m)]=newPolicy[self.code(m)]-alpha*(exp(policy[self.code(m)])/z)
-            state = self.play(state, move)
-        return newPolicy
-
-    def create_slideshow(self, n, stabilized=False):
-        policy = [random.randint(0,len(self.slides_ids))/len(self.slides_ids) for _ in range(len(self.slides_ids))]
+            legal_codes.append([self.code(m) for m in self.legal_moves(state)])
+            state[0].append(move)
+            state[1].remove(move)
+        return policy.adapt([self.code(m) for m in sequence], legal_codes, alpha=alpha)
+
+    def initial_policy(self):
+        # Weights are indexed by the codes of the moves, that is by positions in slides_ids
+        weights = [random.randint(0,len(self.slides_ids))/len(self.slides_ids) for _ in range(len(self.slides_ids))]
+        return Policy(weights)
+
+    @PROFILER.traced('nrpa.search')
+    def search(self, n, policy, stabilized=False):
         if stabilized:
-            bestScore, bestSeq = self.stabilizedNrpa(n, policy)
+            result = self.stabilizedNrpa(n, policy)
         else:
-            bestScore, bestSeq = self.nrpa(n, policy)
-        ss = Slideshow()
-        [ss.add_right(self.slides[s]) for s in bestSeq]
-        return ss
-
-    def run(self, n, verbose=1, stabilized=False):
-        if stabilized:
-            slideshow = self.create_slideshow(n, stabilized=True)
-        else:
-            slideshow = self.create_slideshow(n)
+            result = self.nrpa(n, policy)
+        self.incumbent.update(*result)
+        return result
+
+    def create_slideshow(self, n, stabilized=False, restarts=1, budget=None):
+        """ Runs NRPA (or stabilized NRPA) at level n.
+        With n_jobs > 1, restarts independent searches run in parallel (root parallelization) and the best
+        one is kept. With a single restart, the P level 1 playouts of stabilized NRPA are split among the workers,
+        which get the policy once per level 1 search (one task each).
+        :param budget: Time budget in seconds (None for no limit). When it is over, the search stops at every
+        level and the best slideshow found so far is returned.
+        """
+        self.start_search(budget)
+        with worker_pool(self, self.n_jobs):
+            if restarts > 1 and self.workers is not None:
+                seeds = [random.getrandbits(32) for _ in range(restarts)]
+                # Workers are forked after start_search : they share the deadline
+                for score, seq in self.workers.map(_search_worker, [(n, stabilized, seed) for seed in seeds]):
+                    self.incumbent.update(score, seq)
+            else:
+                for _ in range(restarts):
+                    self.search(n, self.initial_policy(), stabilized=stabilized)
+                    if self.expired():
+                        break
+        return self.best_slideshow()
+
+    def run(self, n, verbose=1, stabilized=False, restarts=1, budget=None):
+        slideshow = self.create_slideshow(n, stabilized=stabilized, restarts=restarts, budget=budget)
         score = score_slideshow(slideshow)
         print(f'Score : {score}') if verbose > 0 else 0
         return slideshow
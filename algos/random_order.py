@@ -1,4 +1,6 @@
 from base import *
+from dataset import *
+from pairing import *
 from utils import *
 
 from tqdm import tqdm
@@ -8,25 +10,8 @@ import random
 class RandomSolution:
 
     @timeit
-    def form_slides(self, photos):
-        # Naive algorithm where
-        # vertical photos are paired sequentially as they are read.
-        slides = []
-        remaining_vertical = None
-        for photo in photos:
-            if photo.is_vertical() and remaining_vertical is not None:
-                slide = Slide(remaining_vertical, photo)
-                slides.append(slide)
-                remaining_vertical = None
-            elif photo.is_vertical() and remaining_vertical is None:
-                remaining_vertical = photo
-            else:
-                # Photo is horizontal
-                slide = Slide(photo)
-                slides.append(slide)
-
-        assert remaining_vertical is None, f"One vertical photo remains... Kinda strange."
-        return slides
+    def form_slides(self, photos, pairing=DEFAULT_PAIRING):
+        return form_slides(photos, pairing=pairing)
 
     def create_random_slideshow(self, slides):
         random.shuffle(slides)
@@ -50,10 +35,8 @@ class RandomSolution:
         print("All scores :", all_scores)
         return best_slideshow
 
-    def run(self, filename, num_iters):
-        photos = load_data(filename)
-
-        slides = self.form_slides(photos)
+    def run(self, filename, num_iters, pairing=DEFAULT_PAIRING):
+        slides = list(load_dataset(filename, pairing=pairing).slides)
         slideshow = self.create_slideshow(slides, num_iters=num_iters)
         score = score_slideshow(slideshow)
 
@@ -1,4 +1,7 @@
 from base import *
+from dataset import *
+from pairing import *
+from search import *
 from utils import *
 
 from tqdm import trange, tqdm
@@ -8,35 +11,32 @@ import math
 import copy
 
 
-class UCBSolution:
+class UCBSolution(AnytimeSearch):
 
     @timeit
-    def form_slides(self, photos):
-        # Naive algorithm where
-        # vertical photos are paired sequentially as they are read.
-        slides = []
-        remaining_vertical = None
-        for photo in photos:
-            if photo.is_vertical() and remaining_vertical is not None:
-                slide = Slide(remaining_vertical, photo)
-                slides.append(slide)
-                remaining_vertical = None
-            elif photo.is_vertical() and remaining_vertical is None:
-                remaining_vertical = photo
-            else:
-                # Photo is horizontal
-                slide = Slide(photo)
-                slides.append(slide)
-
-        assert remaining_vertical is None, f"One vertical photo remains... Kinda strange."
-        return slides
+    def form_slides(self, photos, pairing=DEFAULT_PAIRING):
+        return form_slides(photos, pairing=pairing)
 
     def get_candidate_idx_slides(self, sorted_idx_slides, max_candidates=100):
         # Returning the longest
-        return sorted_idx_slides[:max_candidates]
-
-    def playout(self,current_idx_slide, idx_slides, all_slides):
-        sample = random.sample(idx_slides, k=min(len(idx_slides), 10))
+        return sorted_idx_slides.top(max_candidates)
+
+    def get_sharing_idx_slides(self, index, current_idx_slide, sorted_idx_slides, max_candidates=100, graph=None):
+        # Remaining successors of the current slide in the graph, else remaining slides sharing a tag with it,
+        # or the longest if there are none
+        if graph is not None:
+            candidates = [s for s in graph.successors(current_idx_slide) if s in sorted_idx_slides][:max_candidates]
+            if len(candidates) > 0:
+                return candidates
+        candidates = index.candidates(current_idx_slide, max_candidates=max_candidates).tolist()
+        if len(candidates) == 0:
+            candidates = self.get_candidate_idx_slides(sorted_idx_slides, max_candidates=max_candidates)
+        return candidates
+
+    def playout(self, current_idx_slide, idx_slides, all_slides):
+        if PROFILER.enabled:
+            PROFILER.count('rollouts')
+        sample = idx_slides.sample(10, exclude=current_idx_slide)
         res = 0
         prev_idx = current_idx_slide
         for idx in sample:
@@ -44,9 +44,13 @@ class UCBSolution:
             prev_idx = idx
         return res
 
-    def UCB(self, current_idx_slide, possible_idx_slides, idx_slides, all_slides, n_sims, constant=0.7):
+    def UCB(self, current_idx_slide, possible_idx_slides, idx_slides, all_slides, n_sims, constant=0.7, store=None):
         scores = [[idx, 0, 0, idx, i] for i, idx in enumerate(possible_idx_slides)]  # idx, score, num chosen
+        store = SlideStore.from_slides(all_slides) if store is None else store
+        transition_scores = store.score_many(current_idx_slide, possible_idx_slides).tolist()
         for s in range(1, n_sims+1):
+            if s > 1 and self.expired():
+                break
             best_val = 0
             best_idx_slide = None
             best_i = None  # Index for scores
@@ -59,10 +63,8 @@ class UCBSolution:
                     best_val = val
                     best_idx_slide = idx_slide
                     best_i = i
-            res = score_slides(all_slides[current_idx_slide], all_slides[best_idx_slide])
-            copy_idx_slides = idx_slides[:]
-            copy_idx_slides.remove(best_idx_slide)
-            res += self.playout(best_idx_slide, copy_idx_slides, all_slides)
+            res = transition_scores[best_i]
+            res += self.playout(best_idx_slide, idx_slides, all_slides)
             scores[best_i][2] += 1
             scores[best_i][1] += res
 
@@ -70,41 +72,62 @@ class UCBSolution:
         return max(scores,  key=lambda x: x[2])[0]
 
     @timeit
-    def create_slideshow(self, src_slides, max_candidates=100, ucb_constant=0.7):
-        idx_slides = sorted(range(0, len(src_slides)), key=lambda x: -len(src_slides[x].get_tags()))
+    def create_slideshow(self, src_slides, max_candidates=100, ucb_constant=0.7, store=None, budget=None, graph=None):
+        """
+        :param budget: Time budget in seconds (None for no limit). When it is over, the remaining slides are
+        appended in the order of the pool.
+        :param graph: knn.TransitionGraph of the slides. The candidates are then the remaining successors of the
+        current slide in the graph, as long as there are some.
+        """
+        self.start_search(budget)
+        store = SlideStore.from_slides(src_slides) if store is None else store
+        sorted_idx_slides = store.sorted_by_num_tags()
+        idx_slides = SlidePool(sorted_idx_slides)
+        index = InvertedIndex(store, order=sorted_idx_slides)
 
         seed_idx = 0
         next_idx_slide = seed_idx  # So that the loop is coherent : we need to know idx
-        seed = src_slides[seed_idx]
         idx_slides.remove(seed_idx)
-        sh = Slideshow()
-        sh.add_right(seed)
+        index.remove(seed_idx)
+        sh = Slideshow(src_slides)
+        sh.add_right_idx(seed_idx)
 
         num_random = 0
         t = trange(len(src_slides)-1, desc='Create slideshow', leave=True)
         for _ in t:
-            sample_idx_slides = self.get_candidate_idx_slides(list(idx_slides), max_candidates=max_candidates)
+            if self.expired():
+                # Out of time : the remaining slides follow in the order of the pool
+                for idx_slide in list(idx_slides):
+                    idx_slides.remove(idx_slide)
+                    sh.add_right_idx(idx_slide)
+                break
+            sample_idx_slides = self.get_sharing_idx_slides(index, next_idx_slide, idx_slides,
+                                                            max_candidates=max_candidates, graph=graph)
             if len(sample_idx_slides) > 0:
                 next_idx_slide = self.UCB(next_idx_slide, sample_idx_slides, idx_slides, src_slides,
-                                          n_sims=max_candidates*3, constant=ucb_constant)
+                                          n_sims=max_candidates*3, constant=ucb_constant, store=store)
             else:
                 # Choose randomly
                 num_random += 1
-                next_idx_slide = random.choice(list(idx_slides))
-            next_slide = src_slides[next_idx_slide]
+                next_idx_slide = idx_slides.sample()
             idx_slides.remove(next_idx_slide)
-            sh.add_right(next_slide)
+            index.remove(next_idx_slide)
+            sh.add_right_idx(next_idx_slide)
 
         print(f'Num random : {num_random}/{len(src_slides)}')
         assert len(idx_slides) == 0
         return sh
 
-    def run(self, filename, max_candidates=100, ucb_constant=0.7):
-        photos = load_data(filename)
-        slides = self.form_slides(photos)
-        del photos
+    def run(self, filename, max_candidates=100, ucb_constant=0.7, pairing=DEFAULT_PAIRING, budget=None, knn=DEFAULT_K):
+        """
+        :param knn: Number of successors of every slide in the transition graph, 0 not to use the graph.
+        """
+        dataset = load_dataset(filename, pairing=pairing)
+        slides = dataset.slides
         print(f'Num slides : {len(slides)}')
-        slideshow = self.create_slideshow(slides, max_candidates=max_candidates, ucb_constant=ucb_constant)
+        graph = dataset.transition_graph(k=knn) if knn > 0 else None
+        slideshow = self.create_slideshow(slides, max_candidates=max_candidates, ucb_constant=ucb_constant,
+                                          store=dataset.store, budget=budget, graph=graph)
         score = score_slideshow(slideshow)
         print(f'Score : {score}')
         return slideshow
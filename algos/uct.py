@@ -1,74 +1,152 @@
 from base import *
+from dataset import *
+from pairing import *
+from parallel import *
+from search import *
 from utils import *
 
 import math
 import random
+import time
 import copy
 
 
-class UCT:
+###########################################
+# Worker processes
+###########################################
 
-    def __init__(self, filename, max_slides=200, max_candidates=3):
-        photos = load_data(filename)
-        self.slides = self.form_slides(photos)
+def _replay(solution, sequence):
+    state = solution.new_state()
+    for move in sequence:
+        state.play(move)
+    return state
+
+
+def _root_search_worker(args):
+    # Independent search from the root, returning the root statistics
+    sequence, n, c = args
+    solution = get_worker_solution()
+    state = _replay(solution, sequence)
+    table = TranspositionTable(solution.table_size)
+    for i in range(n):
+        # The deadline of the parent search is inherited through the fork
+        if i > 0 and solution.expired():
+            break
+        solution.uct(state, table, c)
+    t = table.get(state.hash)
+    return t[1], t[2]
+
+
+def _leaf_playouts_worker(args):
+    # Playouts from a leaf, given by its last slide, its score and the remaining slides in the order of the pool
+    last, score, remaining, num_playouts = args
+    solution = get_worker_solution()
+    pool = SlidePool(remaining)
+    return sum(solution.playout_from(last, pool, score) for _ in range(num_playouts))
+
+
+class UCT(AnytimeSearch):
+
+    def __init__(self, filename, max_slides=200, max_candidates=3, pairing=DEFAULT_PAIRING, table_size=1 << 18,
+                 n_jobs=1, parallel='root', leaf_playouts=1, knn=DEFAULT_K):
+        self.dataset = load_dataset(filename, pairing=pairing)
+        self.slides = self.dataset.slides
         print(f'Num slides : {len(self.slides)}')
-        self.slides_ids = sorted(range(len(self.slides[:max_slides])), key=lambda x: -len(self.slides[x].get_tags()))
+        self.store = self.dataset.store
+        self.knn = knn  # Number of successors of every slide in the transition graph, 0 not to use it
+        self.use_slides(self.store.sorted_by_num_tags(max_slides))
+        self.transitions = TransitionCache(self.slides)
         self.max_candidates = max_candidates
+        self.zobrist = Zobrist(len(self.slides))
+        self.table_size = table_size  # Maximum number of nodes kept in the transposition table
+        # Parallelization, with n_jobs worker processes :
+        # - 'root' : independent searches whose root statistics are merged,
+        # - 'leaf' : a single tree, expanded by batches of n_jobs leaves whose playouts run in parallel.
+        assert parallel in ('root', 'leaf'), f"Unknown parallelization '{parallel}'."
+        self.n_jobs = n_jobs
+        self.parallel = parallel
+        self.leaf_playouts = leaf_playouts
+        self.workers = None  # Process pool, only alive during create_slideshow
+
+    def use_slides(self, slide_ids):
+        """ Sets the slides to arrange, as indexes in self.slides (e.g. one chunk of the dataset). """
+        self.slides_ids = list(slide_ids)
+        self.pool = SlidePool(self.slides_ids)
+        # Legal moves are drawn from the transition graph of the slides, if there is one
+        self.graph = self.dataset.transition_graph(k=self.knn, slide_ids=self.slides_ids) if self.knn > 0 else None
 
     @timeit
-    def form_slides(self, photos):
-        # Naive algorithm where
-        # vertical photos are paired sequentially as they are read.
-        slides = []
-        remaining_vertical = None
-        for photo in photos:
-            if photo.is_vertical() and remaining_vertical is not None:
-                slide = Slide(remaining_vertical, photo)
-                slides.append(slide)
-                remaining_vertical = None
-            elif photo.is_vertical() and remaining_vertical is None:
-                remaining_vertical = photo
-            else:
-                # Photo is horizontal
-                slide = Slide(photo)
-                slides.append(slide)
-        assert remaining_vertical is None, f"One vertical photo remains... Kinda strange."
-        return slides
+    def form_slides(self, photos, pairing=DEFAULT_PAIRING):
+        return form_slides(photos, pairing=pairing)
 
     def legal_moves(self, state):
-        return state[1][:self.max_candidates]
+        if self.graph is not None:
+            return self.graph.legal_moves(state.sequence[-1] if len(state) > 0 else None, state.pool,
+                                          self.max_candidates)
+        return state.pool.top(self.max_candidates)
 
     def terminal(self, slideshow):
         return len(slideshow) == len(self.slides_ids)
 
     def play(self, state, move):
-        assert move in state[1]
-        state = copy.deepcopy(state)
-        if len(state[0]) > 0:
-            s = score_slides(self.slides[state[0][-1]], self.slides[move]) + state[2]
-        else:
-            s = 0
-        state[0].append(move)
-        state[1].remove(move)
-        h = state[-1] ^ move
-        return state[0], state[1], s, h
+        state.play(move)
+        return state
+
+    def new_state(self):
+        return SearchState(self.pool.copy(), self.transitions, zobrist=self.zobrist)
 
     def playout(self, state):
-        while len(state[1]) > 0:
-            moves = self.legal_moves(state)
-            move = random.choice(moves)
-            state = self.play(state, move)
-        return state[2]
+        """ Random playout from state, returning its final score. state is only read. """
+        return self.playout_from(state.sequence[-1] if len(state) > 0 else None, state.pool, state.score)
 
-    def uct(self, state, table, c):
-        if self.terminal(state[0]):
-            return state[2]
-        t = table.get(state[-1], None)  # [num playout, [num chosen for each move], [sum score for each move]]
-        if t is not None:
+    def playout_from(self, last, pool, score):
+        """ Random playout from the last slide of a slideshow of the given score, the remaining slides being in pool.
+        pool is only read : the legal moves are a window sliding over its linked list.
+        """
+        if PROFILER.enabled:
+            PROFILER.count('rollouts')
+        score_transition = self.transitions.score
+        if self.graph is not None:
+            return score + self.graph.playout(last, pool, self.max_candidates, score_transition)[0]
+        window = pool.top(self.max_candidates)
+        cursor = pool.next[window[-1]] if len(window) > 0 else pool.head
+        while len(window) > 0:
+            move = window.pop(random.randrange(len(window)))
+            if cursor != pool.head:
+                window.append(cursor)
+                cursor = pool.next[cursor]
+            score += score_transition(last, move) if last is not None else 0
+            last = move
+        return score
+
+    def leaf_playout(self, state):
+        """ Runs leaf_playouts playouts from state.
+        :return: (sum of the scores, number of playouts)
+        """
+        if self.leaf_playouts <= 1:
+            return self.playout(state), 1
+        return sum(self.playout(state) for _ in range(self.leaf_playouts)), self.leaf_playouts
+
+    def select(self, state, table, c):
+        """ Descent in the tree with UCB from state, up to the expansion of one node or the end of the slideshow.
+        The moves are played in state : the caller undoes them.
+        Nodes are entries of the transposition table, keyed by the Zobrist hash of the state :
+        [num playouts, [num chosen for each move], [sum score for each move], legal moves, last slide]
+        :return: (path of (node, index of the move played), True if a node was expanded)
+        """
+        path = []
+        while not self.terminal(state.sequence):
+            t = table.get(state.hash)
+            moves = self.legal_moves(state)
+            if t is None:
+                last = state.sequence[-1] if len(state) > 0 else None
+                table.put(state.hash, [0, [0] * len(moves), [0.] * len(moves), moves, last])
+                if PROFILER.enabled:
+                    PROFILER.count('nodes_expanded')
+                return path, True
             best_value = -1
             best = 0
-            moves = self.legal_moves(state)
-            for i, m in enumerate(moves):
+            for i in range(len(moves)):
                 val = 100_000
                 if t[1][i] > 0:
                     Q = t[2][i] / t[1][i]  # Mean score
@@ -76,40 +154,171 @@ class UCT:
                 if val > best_value:
                     best_value = val
                     best = i
-            state = self.play(state, moves[best])
-            res = self.uct(state, table, c)
-            t[0] += 1
-            t[1][best] += 1
+            path.append((t, best))
+            state.play(moves[best])
+        return path, False
+
+    def backpropagate(self, path, res, num):
+        for t, best in path:
+            t[0] += num
+            t[1][best] += num
             t[2][best] += res
-            return res
-        else:
-            num_playouts = [0. for _ in range(self.max_candidates)]
-            scores = [0. for _ in range(self.max_candidates)]
-            table[state[-1]] = [0, num_playouts, scores]
-            return self.playout(state)
-
-    def best_move(self, state, n, c):
-        table = {}
-        for _ in range(n):
-            s1 = copy.deepcopy(state)
-            _ = self.uct(s1, table, c)
+
+    def uct(self, state, table, c):
+        """ One simulation from state : descent in the tree with UCB, expansion of one node, playout and
+        backpropagation. The descent plays moves in place and undoes them, state is left unchanged.
+        """
+        start = len(state)
+        path, expanded = self.select(state, table, c)
+        res, num = self.leaf_playout(state) if expanded else (state.score, 1)
+        self.backpropagate(path, res, num)
+        state.undo_to(start)
+        return res / num
+
+    def uct_batch(self, state, table, c, batch):
+        """ Leaf parallelization : batch simulations whose playouts run in the worker processes, in one map.
+        Every descent counts its visits at once, before its score is known (virtual loss), so that the next
+        descents of the batch go to other leaves. The score is added when the playouts are over.
+        A worker gets the remaining slides of its leaf rather than its sequence : it rebuilds the pool once,
+        without replaying the moves, and runs the leaf_playouts playouts of the leaf.
+        """
+        start = len(state)
+        leaves = []
+        for _ in range(batch):
+            path, expanded = self.select(state, table, c)
+            if expanded:
+                last = state.sequence[-1] if len(state) > 0 else None
+                leaves.append((path, (last, state.score, list(state.pool), self.leaf_playouts)))
+                self.backpropagate(path, 0., self.leaf_playouts)
+            else:
+                self.backpropagate(path, state.score, 1)
+            state.undo_to(start)
+        if len(leaves) > 0:
+            results = self.workers.map(_leaf_playouts_worker, [task for _, task in leaves])
+            for (path, _), res in zip(leaves, results):
+                self.backpropagate(path, res, 0)
+
+    @PROFILER.traced('uct.best_move')
+    def best_move(self, state, n, c, table=None):
+        """ Runs simulations from state until its node has been visited n times, and returns the most visited move.
+        Visits carried over from previous searches in table count.
+        Simulations stop early when the deadline is expired (after at least one).
+        With leaf parallelization, simulations run by batches of n_jobs (see uct_batch).
+        """
+        table = TranspositionTable(self.table_size) if table is None else table
+        t = table.get(state.hash)
+        i, num_simulations = 0, n - (t[0] if t is not None else 0)
+        while i < num_simulations:
+            if i > 0 and self.expired():
+                break
+            if self.workers is not None and self.parallel == 'leaf':
+                batch = min(self.n_jobs, num_simulations - i)
+                self.uct_batch(state, table, c, batch)
+            else:
+                batch = 1
+                self.uct(state, table, c)
+            i += batch
         moves = self.legal_moves(state)
-        best_move_idx = max(range(self.max_candidates), key=lambda x: table.get(state[-1], 0)[1][x])
+        t = table.get(state.hash)
+        best_move_idx = max(range(len(moves)), key=lambda x: t[1][x])
         best_move = moves[best_move_idx]
-        mean_score = table.get(state[-1], 0)[2][best_move_idx] / table.get(state[-1], 0)[1][best_move_idx]
+        mean_score = t[2][best_move_idx] / max(t[1][best_move_idx], 1)
         return best_move, mean_score
 
-    def create_slideshow(self, n, c):
-        state = ([], self.slides_ids[:], 0, hash('begin'))
-        ss = Slideshow()
-        while not self.terminal(state[0]):
-            best_move, ms = self.best_move(state, n, c)
-            state = self.play(state, best_move)
-        [ss.add_right(self.slides[s]) for s in state[0]]
-        return ss
-
-    def run(self, n, c, verbose=1):
-        slideshow = self.create_slideshow(n, c)
+    @PROFILER.traced('uct.best_move_root_parallel')
+    def best_move_root_parallel(self, state, n, c):
+        """ Root parallelization : every worker runs n / n_jobs simulations in its own tree,
+        then the visit counts and scores of the root moves are summed.
+        """
+        per_worker = math.ceil(n / self.n_jobs)
+        results = self.workers.map(_root_search_worker, [(state.sequence, per_worker, c)] * self.n_jobs)
+        visits = [sum(v) for v in zip(*[r[0] for r in results])]
+        scores = [sum(v) for v in zip(*[r[1] for r in results])]
+        best_move_idx = max(range(len(visits)), key=lambda x: visits[x])
+        return self.legal_moves(state)[best_move_idx], scores[best_move_idx] / max(visits[best_move_idx], 1)
+
+    def prune(self, table, state):
+        """ Keeps in table only the nodes reachable from state (the subtree of the move just played),
+        dropping its ancestors and the sibling subtrees.
+        """
+        reachable = set()
+        stack = [state.hash]
+        while len(stack) > 0:
+            h = stack.pop()
+            if h in reachable or h not in table:
+                continue
+            reachable.add(h)
+            _, visits, _, moves, last = table.entries[h]
+            stack.extend(self.zobrist.play(h, last, m) for i, m in enumerate(moves) if visits[i] > 0)
+        for h in [h for h in table.entries if h not in reachable]:
+            del table.entries[h]
+
+    def complete(self, state, table):
+        """ Plays the remaining moves without searching : the most visited move while the state is in the tree,
+        then the remaining slides in the order of the pool.
+        """
+        while not self.terminal(state.sequence):
+            moves = self.legal_moves(state)
+            t = table.get(state.hash)
+            best = max(range(len(moves)), key=lambda i: t[1][i]) if t is not None else 0
+            state = self.play(state, moves[best])
+        return state
+
+    def create_slideshow(self, n, c, reuse_tree=True, budget=None):
+        """ Plays the most visited move of a UCT search, again and again.
+        With reuse_tree, the subtree of the played move is kept, with its statistics, for the next search
+        (except with root parallelization, whose trees live in the workers).
+        :param budget: Time budget in seconds (None for no limit). When it is over, the slideshow is completed
+        without searching (see complete).
+        """
+        self.start_search(budget)
+        state = self.new_state()
+        table = TranspositionTable(self.table_size)
+        with worker_pool(self, self.n_jobs):
+            while not self.terminal(state.sequence):
+                if self.expired():
+                    state = self.complete(state, table)
+                    break
+                if self.workers is not None and self.parallel == 'root':
+                    best_move, ms = self.best_move_root_parallel(state, n, c)
+                else:
+                    best_move, ms = self.best_move(state, n, c, table=table)
+                state = self.play(state, best_move)
+                if reuse_tree:
+                    self.prune(table, state)
+                else:
+                    table = TranspositionTable(self.table_size)
+        self.incumbent.update(state.score, state.sequence)
+        return self.best_slideshow()
+
+    def scaling_report(self, n, c, max_workers, num_moves=5):
+        """ Simulations per second of the parallel search for 1 to max_workers workers,
+        measured over the first num_moves moves of a slideshow.
+        :return: list of dict (workers, simulations, seconds, sims_per_sec)
+        """
+        n_jobs = self.n_jobs
+        rows = []
+        for workers in range(1, max_workers + 1):
+            self.n_jobs = workers
+            with worker_pool(self, workers):
+                state = self.new_state()
+                ts = time.perf_counter()
+                for _ in range(num_moves):
+                    if self.workers is not None and self.parallel == 'root':
+                        best_move, _ = self.best_move_root_parallel(state, n, c)
+                    else:
+                        best_move, _ = self.best_move(state, n, c)
+                    state = self.play(state, best_move)
+                seconds = time.perf_counter() - ts
+            simulations = n * num_moves * (self.leaf_playouts if self.parallel == 'leaf' else 1)
+            rows.append({'workers': workers, 'simulations': simulations, 'seconds': seconds,
+                         'sims_per_sec': simulations / seconds})
+            print(f"{workers} workers : {rows[-1]['sims_per_sec']:.0f} simulations/sec")
+        self.n_jobs = n_jobs
+        return rows
+
+    def run(self, n, c, verbose=1, reuse_tree=True, budget=None):
+        slideshow = self.create_slideshow(n, c, reuse_tree=reuse_tree, budget=budget)
         score = score_slideshow(slideshow)
         print(f'Score : {score}') if verbose > 0 else 0
         return slideshow
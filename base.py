@@ -1,10 +1,47 @@
 
 
+from profiling import PROFILER
+
+from array import array
+from collections import OrderedDict
+import random
+
+import numpy as np
+
+
+class TagIndex:
+    """
+    Interns tags : maps every tag (string) to a dense integer id.
+    Ids are given in order of first appearance, starting at 0.
+    """
+
+    def __init__(self):
+        self.ids = {}  # tag -> id
+        self.names = []  # id -> tag
+
+    def intern(self, tag):
+        tag_id = self.ids.get(tag)
+        if tag_id is None:
+            tag_id = len(self.names)
+            self.ids[tag] = tag_id
+            self.names.append(tag)
+        return tag_id
+
+    def intern_all(self, tags):
+        return {self.intern(tag) for tag in tags}
+
+    def get_name(self, tag_id):
+        return self.names[tag_id]
+
+    def __len__(self):
+        return len(self.names)
+
+
 class Photo:
     """
     Represents a photo. Photo has
     - an orientation which can be 'V' or 'H',
-    - a set of tags.
+    - a set of tags (interned integer ids when loaded with load_data).
     """
 
     def __init__(self, orientation, tags):
@@ -56,37 +93,670 @@ class Slide:
 
 class Slideshow:
     """
-    Represents an ordered sequence of slides.
-    Can make the slideshow grow by adding one slide to the left or to the right at a time.
-    Can also see the current slide at the left/right.
+    Represents an ordered sequence of slides, stored as int32 indexes in a catalog of Slide objects :
+    - indexes : the slides of the slideshow, from left to right,
+    - scores : position-aligned transition scores, scores[i] from slide i - 1 to slide i (0 for the first slide),
+    - total : the sum of scores, maintained by every change.
+    Can make the slideshow grow by adding one slide to the left or to the right at a time, in amortized O(1)
+    (the arrays keep free room at both ends), and edit a segment (reverse, replace), rescoring only the
+    transitions it changes. Can also see the current slide at the left/right.
+    The catalog is either given (e.g. the slides of a dataset, then slides are added by index), or owned by the
+    slideshow, which appends to it the slides given to add_left / add_right.
     """
 
-    def __init__(self):
-        self.slides = []
-        self.scores = []
+    def __init__(self, catalog=None, capacity=16):
+        """
+        :param catalog: Sequence of the Slide objects the indexes refer to. None for a catalog of its own.
+        :param capacity: Initial size of the arrays.
+        """
+        self.owns_catalog = catalog is None
+        self.catalog = [] if catalog is None else catalog
+        self._indexes = np.zeros(max(capacity, 2), dtype=np.int32)
+        self._scores = np.zeros(max(capacity, 2), dtype=np.int32)
+        self.start = self.end = len(self._indexes) // 2
+        self.total = 0
+
+    @classmethod
+    def from_indexes(cls, catalog, idx_slides, store=None):
+        """ Slideshow of the slides catalog[i] for i in idx_slides.
+        :param store: SlideStore of the catalog, to score all the transitions at once (see SlideStore.score_pairs).
+        """
+        idx_slides = np.asarray(idx_slides, dtype=np.int32)
+        n = len(idx_slides)
+        slideshow = cls(catalog, capacity=max(2 * n, 16))
+        slideshow.start = (len(slideshow._indexes) - n) // 2
+        slideshow.end = slideshow.start + n
+        slideshow._indexes[slideshow.start:slideshow.end] = idx_slides
+        if n > 1:
+            if store is not None:
+                scores = store.score_pairs(idx_slides[:-1], idx_slides[1:])
+            else:
+                slides = [catalog[i] for i in idx_slides.tolist()]
+                scores = [score_slides(a, b) for a, b in zip(slides, slides[1:])]
+            slideshow._scores[slideshow.start+1:slideshow.end] = scores
+        slideshow.total = int(slideshow.scores.sum())
+        return slideshow
+
+    def score_transition(self, idx_slide1, idx_slide2):
+        return score_slides(self.catalog[idx_slide1], self.catalog[idx_slide2])
+
+    def _reserve(self, n):
+        """ Re-centers the slideshow in arrays with room for n more slides at both ends. """
+        size = len(self)
+        capacity = max(2 * len(self._indexes), size + 2 * n + 2)
+        start = (capacity - size) // 2
+        for name in ('_indexes', '_scores'):
+            arr = np.zeros(capacity, dtype=np.int32)
+            arr[start:start+size] = getattr(self, name)[self.start:self.end]
+            setattr(self, name, arr)
+        self.start, self.end = start, start + size
+
+    def _add(self, slide):
+        assert self.owns_catalog, "The catalog is shared : add slides by index."
+        self.catalog.append(slide)
+        return len(self.catalog) - 1
 
     def add_left(self, slide):
-        self.scores.append(score_slides(self.slides[0], slide)) if len(self) > 0 else self.scores.append(0)
-        self.slides.insert(0, slide)
+        self.add_left_idx(self._add(slide))
 
     def add_right(self, slide):
-        self.scores.append(score_slides(self.slides[-1], slide)) if len(self) > 0 else self.scores.append(0)
-        self.slides.append(slide)
+        self.add_right_idx(self._add(slide))
+
+    def add_left_idx(self, idx_slide):
+        """ Adds the slide catalog[idx_slide] to the left. """
+        if self.start == 0:
+            self._reserve(1)
+        if len(self) > 0:
+            score = self.score_transition(idx_slide, self._indexes[self.start])
+            self._scores[self.start] = score
+            self.total += score
+        self.start -= 1
+        self._indexes[self.start] = idx_slide
+        self._scores[self.start] = 0
+
+    def add_right_idx(self, idx_slide):
+        """ Adds the slide catalog[idx_slide] to the right. """
+        if self.end == len(self._indexes):
+            self._reserve(1)
+        score = self.score_transition(self._indexes[self.end-1], idx_slide) if len(self) > 0 else 0
+        self._indexes[self.end] = idx_slide
+        self._scores[self.end] = score
+        self.total += score
+        self.end += 1
+
+    def _rescore(self, positions):
+        """ Recomputes the transitions to the slides at the given (absolute) positions. """
+        for p in positions:
+            if self.start <= p < self.end:
+                score = self.score_transition(self._indexes[p-1], self._indexes[p]) if p > self.start else 0
+                self.total += score - int(self._scores[p])
+                self._scores[p] = score
+
+    def reverse(self, i, j):
+        """ Reverses the slides at positions i to j - 1. Only the transitions at both ends of the segment are
+        rescored : the ones inside are the same, in reverse order.
+        """
+        a, b = self.start + i, self.start + j
+        if b - a < 2:
+            return
+        self._indexes[a:b] = self._indexes[a:b][::-1].copy()
+        self._scores[a+1:b] = self._scores[a+1:b][::-1].copy()
+        self._rescore((a, b))
+
+    def replace(self, i, j, idx_slides):
+        """ Replaces the slides at positions i to j - 1 by the slides catalog[k] for k in idx_slides
+        (possibly more or fewer). Only the transitions to the new slides and to the next one are rescored.
+        """
+        idx_slides = np.asarray(idx_slides, dtype=np.int32)
+        m = len(idx_slides)
+        growth = m - (j - i)
+        if growth > 0 and self.end + growth > len(self._indexes):
+            self._reserve(growth)
+        a, b = self.start + i, self.start + j
+        # Transitions to the removed slides and to the next one
+        self.total -= int(self._scores[a:min(b + 1, self.end)].sum())
+        if growth != 0:
+            # Shifts the next slides, along with their transitions
+            self._indexes[b+growth:self.end+growth] = self._indexes[b:self.end].copy()
+            self._scores[b+growth:self.end+growth] = self._scores[b:self.end].copy()
+            self.end += growth
+        self._indexes[a:a+m] = idx_slides
+        self._scores[a:min(a + m + 1, self.end)] = 0
+        self._rescore(range(a, a + m + 1))
+
+    @property
+    def indexes(self):
+        """ int32 array of the indexes of the slides in the catalog (a view, not to modify). """
+        return self._indexes[self.start:self.end]
+
+    @property
+    def scores(self):
+        """ int32 array of the position-aligned transition scores (a view, not to modify). """
+        return self._scores[self.start:self.end]
+
+    def score(self):
+        return self.total
 
     def get_slides(self):
-        return self.slides
+        return [self.catalog[i] for i in self.indexes.tolist()]
 
     def get_first(self):
-        return self.slides[0]
+        return self.catalog[self._indexes[self.start]]
 
     def get_last(self):
-        return self.slides[-1]
+        return self.catalog[self._indexes[self.end-1]]
+
+    def __getitem__(self, p):
+        return self.catalog[self.indexes[p]]
+
+    def __iter__(self):
+        return (self.catalog[i] for i in self.indexes.tolist())
 
     def __repr__(self):
-        return repr(self.slides)
+        return repr(self.get_slides())
 
     def __len__(self):
-        return len(self.slides)
+        return self.end - self.start
+
+
+class PhotoTable:
+    """
+    Flat arrays describing a list of photos :
+    - orientations : uint8 array, 1 for a vertical photo and 0 for a horizontal one,
+    - indptr / indices : sorted tag ids of the photos in CSR layout, as in SlideStore.
+    """
+
+    def __init__(self, orientations, indptr, indices, num_tags=None):
+        self.orientations = np.asarray(orientations, dtype=np.uint8)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.num_tags = int(num_tags) if num_tags is not None else int(self.indices.max(initial=-1)) + 1
+
+    def get_tags(self, idx_photo):
+        return self.indices[self.indptr[idx_photo]:self.indptr[idx_photo+1]]
+
+    def is_vertical(self, idx_photo):
+        return bool(self.orientations[idx_photo])
+
+    def to_photos(self):
+        return [Photo('V' if self.orientations[i] else 'H', set(self.get_tags(i).tolist())) for i in range(len(self))]
+
+    def __len__(self):
+        return len(self.orientations)
+
+
+def csr_positions(indptr, rows):
+    """ Positions, in the indices array of a CSR layout, of all the entries of the given rows.
+    :param indptr: CSR offsets.
+    :param rows: int array of row indexes.
+    :return: (positions, owners) where owners[k] is the rank in rows of the row owning positions[k].
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    sizes = indptr[rows + 1] - indptr[rows]
+    ends = np.cumsum(sizes)
+    positions = np.arange(ends[-1] if len(ends) > 0 else 0) + np.repeat(indptr[rows] - ends + sizes, sizes)
+    owners = np.repeat(np.arange(len(rows)), sizes)
+    return positions, owners
+
+
+# Largest one-hot matrix of the slides on the right of SlideStore.score_block (256 MB), above it tags are
+# intersected from an inverted index
+DENSE_BLOCK_BYTES = 1 << 28
+
+
+class SlideStore:
+    """
+    Compact read-only store of the tags of a list of slides, in CSR layout :
+    - indptr : int64 array of size num_slides + 1,
+    - indices : int32 array of sorted tag ids. Tags of slide i are indices[indptr[i]:indptr[i+1]].
+    Slide i of the store is the slide i of the list it was built from.
+    """
+
+    def __init__(self, indptr, indices, num_tags=None):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.num_tags = int(num_tags) if num_tags is not None else int(self.indices.max(initial=-1)) + 1
+        self.sizes = np.diff(self.indptr).astype(np.int32)
+        self._mask = np.zeros(self.num_tags, dtype=np.bool_)  # Scratch buffer for score_many
+
+    @classmethod
+    def from_slides(cls, slides, num_tags=None):
+        """ Builds the store from Slide objects whose tags are integer ids.
+        :param slides: list of Slide.
+        :param num_tags: Size of the tag vocabulary. Inferred from the data if None.
+        :return: SlideStore
+        """
+        sizes = np.fromiter((len(slide.get_tags()) for slide in slides), dtype=np.int64, count=len(slides))
+        indptr = np.zeros(len(slides) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=indptr[1:])
+        indices = np.empty(indptr[-1], dtype=np.int32)
+        for i, slide in enumerate(slides):
+            indices[indptr[i]:indptr[i+1]] = sorted(slide.get_tags())
+        return cls(indptr, indices, num_tags=num_tags)
+
+    @classmethod
+    def from_photo_table(cls, table, content):
+        """ Builds the store of the slides described by content, without building any Slide object.
+        :param table: PhotoTable.
+        :param content: int array of shape (num_slides, 2) holding the photos of every slide, -1 if there is none.
+        :return: SlideStore
+        """
+        content = np.asarray(content, dtype=np.int64)
+        num_slides = len(content)
+        photo_ids = content.ravel()
+        slide_ids = np.repeat(np.arange(num_slides), 2)
+        slide_ids, photo_ids = slide_ids[photo_ids >= 0], photo_ids[photo_ids >= 0]
+
+        # Union of the tags of the photos of each slide, sorted by (slide, tag)
+        positions, owners = csr_positions(table.indptr, photo_ids)
+        keys = np.unique(slide_ids[owners] * table.num_tags + table.indices[positions])
+        indptr = np.zeros(num_slides + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // table.num_tags, minlength=num_slides), out=indptr[1:])
+        return cls(indptr, keys % table.num_tags, num_tags=table.num_tags)
+
+    def get_tags(self, idx_slide):
+        return self.indices[self.indptr[idx_slide]:self.indptr[idx_slide+1]]
+
+    def score(self, idx_slide1, idx_slide2):
+        """ Transition score between two slides of the store, same semantics as score_slides. """
+        common = len(np.intersect1d(self.get_tags(idx_slide1), self.get_tags(idx_slide2), assume_unique=True))
+        return min(common, self.sizes[idx_slide1] - common, self.sizes[idx_slide2] - common)
+
+    def score_many(self, idx_slide, idx_candidates):
+        """ Transition scores between one slide and many candidate slides, in one vectorized pass.
+        :param idx_slide: Index of the slide (left).
+        :param idx_candidates: Sequence of indexes of the candidate slides (right).
+        :return: int array of the scores, aligned with idx_candidates.
+        """
+        idx_candidates = np.asarray(idx_candidates, dtype=np.int64)
+        common = self.count_common(idx_slide, idx_candidates)
+        return np.minimum(common, np.minimum(self.sizes[idx_slide] - common, self.sizes[idx_candidates] - common))
+
+    def count_common(self, idx_slide, idx_candidates):
+        """ Numbers of tags shared by one slide and many candidate slides, in one vectorized pass.
+        :return: int array aligned with idx_candidates.
+        """
+        positions, owners = csr_positions(self.indptr, idx_candidates)
+        tags = self.get_tags(idx_slide)
+        self._mask[tags] = True
+        hits = self._mask[self.indices[positions]]
+        self._mask[tags] = False
+        return np.bincount(owners[hits], minlength=len(idx_candidates))
+
+    def score_pairs(self, idx_slides1, idx_slides2):
+        """ Transition scores between idx_slides1[k] and idx_slides2[k] for every k, in one vectorized pass.
+        :return: int array of the scores.
+        """
+        idx_slides1 = np.asarray(idx_slides1, dtype=np.int64)
+        idx_slides2 = np.asarray(idx_slides2, dtype=np.int64)
+        positions1, owners1 = csr_positions(self.indptr, idx_slides1)
+        positions2, owners2 = csr_positions(self.indptr, idx_slides2)
+        # A (pair, tag) key found on both sides is a common tag of the pair
+        keys = np.concatenate([owners1 * self.num_tags + self.indices[positions1],
+                               owners2 * self.num_tags + self.indices[positions2]])
+        keys.sort()
+        common = np.bincount(keys[1:][keys[1:] == keys[:-1]] // self.num_tags, minlength=len(idx_slides1))
+        sizes1, sizes2 = self.sizes[idx_slides1], self.sizes[idx_slides2]
+        return np.minimum(common, np.minimum(sizes1 - common, sizes2 - common))
+
+    def one_hot(self, idx_slides, dtype=np.float32):
+        """ Dense matrix of shape (len(idx_slides), num_tags), 1 where the slide has the tag. """
+        idx_slides = np.asarray(idx_slides, dtype=np.int64)
+        matrix = np.zeros((len(idx_slides), self.num_tags), dtype=dtype)
+        positions, owners = csr_positions(self.indptr, idx_slides)
+        matrix[owners, self.indices[positions]] = 1
+        return matrix
+
+    def tag_postings(self, idx_slides):
+        """ Inverted index of a set of slides, in CSR layout : (indptr of size num_tags + 1, ranks in idx_slides
+        of the slides having every tag). Its size is the number of tags of the slides, whatever the vocabulary.
+        """
+        idx_slides = np.asarray(idx_slides, dtype=np.int64)
+        positions, owners = csr_positions(self.indptr, idx_slides)
+        tags = self.indices[positions]
+        indptr = np.zeros(self.num_tags + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tags, minlength=self.num_tags), out=indptr[1:])
+        return indptr, owners[np.argsort(tags, kind='stable')]
+
+    def block_columns(self, cols):
+        """ Tags of the slides on the right of score_block, prepared once when they are reused over several blocks :
+        their one_hot matrix if it takes at most DENSE_BLOCK_BYTES, their tag_postings otherwise
+        (large vocabularies, where the one-hot matrices would not fit in memory).
+        """
+        if len(cols) * self.num_tags * np.dtype(np.float32).itemsize <= DENSE_BLOCK_BYTES:
+            return self.one_hot(cols)
+        return self.tag_postings(cols)
+
+    def _common_tags(self, rows, num_cols, postings, max_pairs=1 << 22):
+        """ Numbers of common tags between the slides rows and the slides of postings (see tag_postings),
+        accumulated over the pairs of slides sharing a tag, about max_pairs of them at a time.
+        :return: int32 array of shape (len(rows), num_cols).
+        """
+        posting_indptr, posting_slides = postings
+        rows = np.asarray(rows, dtype=np.int64)
+        positions, owners = csr_positions(self.indptr, rows)
+        tags = self.indices[positions]
+        # Ends of the (row, tag) entries of every row, and of the pairs sharing a tag of every row
+        entry_ends = np.cumsum(self.sizes[rows], dtype=np.int64)
+        num_pairs = posting_indptr[tags + 1] - posting_indptr[tags]
+        pair_ends = np.cumsum(np.bincount(owners, weights=num_pairs, minlength=len(rows)).astype(np.int64))
+        common = np.zeros(len(rows) * num_cols, dtype=np.int32)
+        r0 = 0
+        while r0 < len(rows):
+            # The next rows, as many as fit in max_pairs pairs (at least one)
+            done = pair_ends[r0 - 1] if r0 > 0 else 0
+            r1 = max(int(np.searchsorted(pair_ends, done + max_pairs, side='right')), r0 + 1)
+            e0, e1 = entry_ends[r0 - 1] if r0 > 0 else 0, entry_ends[r1 - 1]
+            pair_positions, pair_owners = csr_positions(posting_indptr, tags[e0:e1])
+            flat = (owners[e0:e1][pair_owners] - r0) * num_cols + posting_slides[pair_positions]
+            common[r0 * num_cols:r1 * num_cols] = np.bincount(flat, minlength=(r1 - r0) * num_cols)
+            r0 = r1
+        return common.reshape(len(rows), num_cols)
+
+    def score_block(self, rows, cols, cols_tags=None):
+        """ All the transition scores between two sets of slides, in one matrix product.
+        With a small vocabulary, it is the product of their one-hot matrices. With a large one, the common tags
+        are counted from the tag_postings of cols (see block_columns) : memory then grows with the number of
+        pairs of slides sharing a tag, not with len(cols) * num_tags.
+        :param rows: Indexes of the slides on the left of the transitions.
+        :param cols: Indexes of the slides on the right of the transitions.
+        :param cols_tags: block_columns(cols), when it is reused over several blocks.
+        :return: int16 array of shape (len(rows), len(cols)).
+        """
+        cols_tags = self.block_columns(cols) if cols_tags is None else cols_tags
+        if isinstance(cols_tags, np.ndarray):
+            # Counts of common tags are exact in float32 (below 2 ** 24)
+            common = (self.one_hot(rows) @ cols_tags.T).astype(np.int16)
+        else:
+            common = self._common_tags(rows, len(cols), cols_tags).astype(np.int16)
+        rows_sizes = self.sizes[np.asarray(rows, dtype=np.int64)].astype(np.int16)[:, None]
+        cols_sizes = self.sizes[np.asarray(cols, dtype=np.int64)].astype(np.int16)[None, :]
+        return np.minimum(common, np.minimum(rows_sizes - common, cols_sizes - common))
+
+    def sorted_by_num_tags(self, max_slides=None):
+        """ Indexes of the first max_slides slides, sorted by decreasing number of tags (stable). """
+        sizes = self.sizes[:max_slides]
+        return np.argsort(-sizes, kind='stable').tolist()
+
+    def __len__(self):
+        return len(self.sizes)
+
+
+class InvertedIndex:
+    """
+    Maintained tag -> slides index over the slides of a SlideStore that are not used yet.
+    Each posting list is sorted by rank, the rank of a slide being its position in order
+    (by default, slides sorted by decreasing number of tags).
+    Used slides are removed lazily : they are skipped when queried and purged once they are too many.
+    """
+
+    def __init__(self, store, order=None):
+        self.store = store
+        order = np.asarray(store.sorted_by_num_tags() if order is None else order, dtype=np.int64)
+        self.order = order
+        self.rank = np.full(len(store), len(order), dtype=np.int64)
+        self.rank[order] = np.arange(len(order))
+        self.used = np.ones(len(store), dtype=np.bool_)
+        self.used[order] = False
+        self.num_remaining = len(order)
+
+        # Transpose the CSR layout, keeping slides of every tag sorted by rank
+        positions, owners = csr_positions(store.indptr, order)
+        tags = store.indices[positions]
+        by_tag = np.lexsort((owners, tags))
+        counts = np.bincount(tags, minlength=store.num_tags)
+        bounds = np.concatenate([[0], np.cumsum(counts)])
+        slides = order[owners[by_tag]]
+        self.postings = [slides[bounds[t]:bounds[t+1]] for t in range(store.num_tags)]
+        self.dead = np.zeros(store.num_tags, dtype=np.int64)  # Used slides still in the posting lists
+
+    def remove(self, idx_slide):
+        assert not self.used[idx_slide], f"Slide {idx_slide} is already used."
+        self.used[idx_slide] = True
+        self.num_remaining -= 1
+        self.dead[self.store.get_tags(idx_slide)] += 1
+
+    def _purge(self, tag):
+        posting = self.postings[tag]
+        self.postings[tag] = posting[~self.used[posting]]
+        self.dead[tag] = 0
+
+    def candidates(self, idx_slide, max_candidates=1000):
+        """ Not-yet-used slides sharing at least one tag with idx_slide.
+        :param idx_slide: Index of the current slide.
+        :param max_candidates: Maximum number of candidates returned, the ones of lowest rank are kept.
+        :return: int array of slide indexes, sorted by rank. Empty if no remaining slide shares a tag.
+        """
+        heads = []
+        for tag in self.store.get_tags(idx_slide):
+            if self.dead[tag] > len(self.postings[tag]) // 4:
+                self._purge(tag)
+            # At least max_candidates unused slides are in the head of the posting list, if there are so many
+            heads.append(self.postings[tag][:max_candidates + self.dead[tag]])
+        if len(heads) == 0:
+            return np.empty(0, dtype=np.int64)
+        slides = np.concatenate(heads)
+        slides = slides[~self.used[slides]]
+        ranks = np.sort(self.rank[slides])
+        first = np.ones(len(ranks), dtype=np.bool_)
+        first[1:] = ranks[1:] != ranks[:-1]
+        ranks = ranks[first][:max_candidates]
+        return self.order[ranks]
+
+    def __len__(self):
+        return self.num_remaining
+
+
+class SlidePool:
+    """
+    Pool of the remaining slides, kept in a fixed order (e.g. by decreasing number of tags) :
+    - removing a slide is O(1) (doubly linked list over the order),
+    - the first k remaining slides are found in O(k),
+    - a uniform random remaining slide is drawn in O(1) (dense array with swap-remove),
+    - copies only duplicate flat containers, which makes snapshots cheap.
+    Links are dicts keyed by slide index : the size of a pool is the number of its slides, whatever their indexes
+    (e.g. 200 slides of a 60000 slides dataset).
+    """
+
+    def __init__(self, order=()):
+        order = list(order)
+        self.head = max(order) + 1 if len(order) > 0 else 0  # Sentinel of the circular linked list
+        chain = [self.head] + order + [self.head]
+        self.next = dict(zip(chain, chain[1:]))
+        self.prev = dict(zip(chain[1:], chain))
+        self.items = order  # Remaining slides, in no particular order
+        self.pos = {idx_slide: i for i, idx_slide in enumerate(order)}  # Position of every remaining slide in items
+
+    def remove(self, idx_slide):
+        assert idx_slide in self, f"Slide {idx_slide} is not in the pool."
+        # Unlink
+        before, after = self.prev[idx_slide], self.next[idx_slide]
+        self.next[before] = after
+        self.prev[after] = before
+        # Swap-remove from items
+        i, last = self.pos[idx_slide], self.items[-1]
+        self.items[i] = last
+        self.pos[last] = i
+        self.items.pop()
+        del self.pos[idx_slide]
+
+    def restore(self, idx_slide):
+        """ Puts back a removed slide at its place in the order.
+        Removals must be undone in reverse order (last removed, first restored), as in dancing links.
+        """
+        assert idx_slide not in self, f"Slide {idx_slide} is already in the pool."
+        self.next[self.prev[idx_slide]] = idx_slide
+        self.prev[self.next[idx_slide]] = idx_slide
+        self.pos[idx_slide] = len(self.items)
+        self.items.append(idx_slide)
+
+    def top(self, k):
+        """ First k remaining slides, in the order of the pool. """
+        res = []
+        idx_slide = self.next[self.head]
+        while idx_slide != self.head and len(res) < k:
+            res.append(idx_slide)
+            idx_slide = self.next[idx_slide]
+        return res
+
+    def first(self):
+        return self.next[self.head] if len(self) > 0 else None
+
+    def sample(self, k=None, exclude=None):
+        """ Uniform random remaining slide, or k distinct ones (fewer if the pool is too small).
+        :param exclude: A slide that must not be drawn.
+        """
+        if k is None:
+            return random.choice(self.items)
+        sample = random.sample(self.items, k=min(len(self), k + (exclude is not None)))
+        if exclude is not None:
+            sample = [idx_slide for idx_slide in sample if idx_slide != exclude]
+        return sample[:k]
+
+    def copy(self):
+        pool = SlidePool.__new__(SlidePool)
+        pool.head = self.head
+        pool.next = self.next.copy()
+        pool.prev = self.prev.copy()
+        pool.items = self.items[:]
+        pool.pos = self.pos.copy()
+        return pool
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __contains__(self, idx_slide):
+        return idx_slide in self.pos
+
+    def __iter__(self):
+        idx_slide = self.next[self.head]
+        while idx_slide != self.head:
+            yield idx_slide
+            idx_slide = self.next[idx_slide]
+
+    def __len__(self):
+        return len(self.items)
+
+
+class TransitionCache:
+    """
+    Memoizes the transition scores between pairs of slides, for searches that score the same pairs again and again.
+    The score is symmetric, so (i, j) and (j, i) share an entry. The cache is emptied once it holds max_size entries :
+    every forked worker process has its own copy, 75 MB at most with the default size.
+    """
+
+    def __init__(self, slides, max_size=1 << 20):
+        self.slides = slides
+        self.num_slides = len(slides)
+        self.max_size = max_size
+        self.scores = {}  # Packed pair i * num_slides + j (i <= j) -> score, about 75 bytes per entry
+
+    def score(self, idx_slide1, idx_slide2):
+        if idx_slide1 < idx_slide2:
+            key = idx_slide1 * self.num_slides + idx_slide2
+        else:
+            key = idx_slide2 * self.num_slides + idx_slide1
+        s = self.scores.get(key)
+        if s is None:
+            if len(self.scores) >= self.max_size:
+                self.scores.clear()
+            s = score_slides(self.slides[idx_slide1], self.slides[idx_slide2])
+            self.scores[key] = s
+        return s
+
+
+class Zobrist:
+    """
+    Zobrist hashing of search states. A state is identified by the set of used slides and the last slide :
+    its hash is the xor of one random 64 bits key per used slide and of one key for the last slide.
+    Playing a move updates the hash in O(1).
+    """
+
+    def __init__(self, num_slides, seed=None):
+        rng = random.Random(seed)
+        self.used_keys = [rng.getrandbits(64) for _ in range(num_slides)]
+        self.last_keys = [rng.getrandbits(64) for _ in range(num_slides)]
+
+    def play(self, h, last, move):
+        """ Hash after playing move from a state of hash h whose last slide is last (None if empty). """
+        h ^= self.used_keys[move] ^ self.last_keys[move]
+        if last is not None:
+            h ^= self.last_keys[last]
+        return h
+
+
+class TranspositionTable:
+    """
+    Bounded map from state hashes to search statistics.
+    When full, the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_size=1 << 18):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def get(self, h):
+        entry = self.entries.get(h)
+        if entry is not None:
+            self.entries.move_to_end(h)
+        return entry
+
+    def put(self, h, entry):
+        self.entries[h] = entry
+        self.entries.move_to_end(h)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __contains__(self, h):
+        return h in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SearchState:
+    """
+    Undo-able state of a slideshow under construction :
+    - sequence : indexes of the slides played so far,
+    - pool : SlidePool of the remaining slides,
+    - score : score of the sequence, accumulated move after move.
+    play and undo are O(1), so that searches explore moves in place instead of copying the state.
+    """
+
+    def __init__(self, pool, transitions, zobrist=None):
+        self.sequence = []
+        self.pool = pool
+        self.transitions = transitions
+        self.score = 0
+        self._gains = []  # Score added by every move, to undo them
+        self.zobrist = zobrist
+        self.hash = 0  # Zobrist hash of (used slides, last slide), maintained if zobrist is given
+
+    def play(self, move):
+        gain = self.transitions.score(self.sequence[-1], move) if len(self.sequence) > 0 else 0
+        if self.zobrist is not None:
+            self.hash = self.zobrist.play(self.hash, self.sequence[-1] if len(self.sequence) > 0 else None, move)
+        self.pool.remove(move)
+        self.sequence.append(move)
+        self._gains.append(gain)
+        self.score += gain
+
+    def undo(self):
+        move = self.sequence.pop()
+        self.pool.restore(move)
+        self.score -= self._gains.pop()
+        if self.zobrist is not None:
+            # Playing is an involution on the hash
+            self.hash = self.zobrist.play(self.hash, self.sequence[-1] if len(self.sequence) > 0 else None, move)
+        return move
+
+    def undo_to(self, length):
+        """ Undoes moves until the sequence has the given length. """
+        while len(self.sequence) > length:
+            self.undo()
+
+    def __len__(self):
+        return len(self.sequence)
 
 
 ###########################################
@@ -99,56 +769,143 @@ def score_slides(slide1, slide2):
     :param slide2: Second slide (right).
     :return: Int score
     """
+    if PROFILER.enabled:
+        PROFILER.count('score_slides')
     common_tags = slide1.get_tags().intersection(slide2.get_tags())
     return min(len(common_tags),
                len(slide1.get_tags()-common_tags),
                len(slide2.get_tags()-common_tags))
 
 
-def score_slideshow(slideshow):
+def score_slideshow(slideshow, rescan=False):
     """ Calculates the total score of the given slideshow.
     :param slideshow: Slideshow
+    :param rescan: If True, every transition is scored again instead of reading the total maintained by the
+    slideshow.
     :return: Int score.
     """
     assert len(slideshow) > 0
+    if not rescan:
+        return slideshow.score()
     slides = slideshow.get_slides()
     # Handle first slide which can be composed of 2 vertical photos - score photos
     s = 0
-    for i in range(1, len(slideshow)):
+    for i in range(1, len(slides)):
         # Between 2 slides
         s += score_slides(slides[i-1], slides[i])
 
     return s
 
 
+def stitch_sequences(store, sequences):
+    """ Chains sequences of slide indexes : starting from the first one, the next one is the remaining sequence
+    (possibly reversed) whose end makes the best transition from the current end.
+    :param store: SlideStore of the slides.
+    :param sequences: list of sequences of slide indexes.
+    :return: list of slide indexes.
+    """
+    sequences = [s for s in sequences if len(s) > 0]
+    if len(sequences) == 0:
+        return []
+    result = list(sequences[0])
+    remaining = list(range(1, len(sequences)))
+    while len(remaining) > 0:
+        # Both ends of every remaining sequence : the first one as is, the last one if it is reversed
+        m = len(remaining)
+        ends = [sequences[c][0] for c in remaining] + [sequences[c][-1] for c in remaining]
+        best = int(np.argmax(store.score_many(result[-1], ends)))
+        c = remaining.pop(best % m)
+        result.extend(sequences[c] if best < m else list(sequences[c])[::-1])
+    return result
+
+
 ###########################################
 # Load data
 ###########################################
 
-def load_data(filename, verbose=1):
-    """ Reads data.
-    :param filename: File containing data about photos.
-    :param verbose: Verbose purposes. Set it to 0 in order to silent everything.
-    :return: list of Photo described in the specified file.
+def iter_lines(filename, chunk_size=1 << 20):
+    """ Reads a text file by chunks and yields its lines, without the line break.
+    :param filename: File to read.
+    :param chunk_size: Number of characters read at a time.
     """
-    # Get lines
     with open(filename, 'r') as f:
-        lines = f.readlines()
-
-    # Parse data line to Photo
-    photos = []
-    true_num_photos = int(lines[0])
-    for i, line in enumerate(lines[1:], start=1):
+        remainder = ''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            lines = (remainder + chunk).split('\n')
+            remainder = lines.pop()
+            yield from lines
+        if remainder:
+            yield remainder
+
+
+def iter_photos(filename, tag_index=None, chunk_size=1 << 20):
+    """ Streams the photos of a file, one at a time.
+    :param filename: File containing data about photos.
+    :param tag_index: TagIndex used to intern the tags. A new one is used if None.
+    :param chunk_size: Number of characters read at a time.
+    :return: Generator of (orientation, sorted list of tag ids).
+    """
+    tag_index = TagIndex() if tag_index is None else tag_index
+    lines = iter_lines(filename, chunk_size=chunk_size)
+    true_num_photos = int(next(lines))
+    num_photos = 0
+    for i, line in enumerate(lines, start=1):
+        array = line.split()
+        if not array:
+            continue
         # Extract info from line
-        array = line.strip().split(' ')
         orientation = array[0]
+        assert orientation in ('V', 'H'), f"Unknown orientation '{orientation}' at line {i}, expected 'V' or 'H'."
         num_tags = int(array[1])
-        tags = set(array[2:])
+        tags = sorted(tag_index.intern_all(array[2:]))
         assert len(tags) == num_tags, f'The number of tags is not what is expected at line {i}.'
-        # Add photo
-        photos.append(Photo(orientation, tags))
+        num_photos += 1
+        yield orientation, tags
+
+    assert true_num_photos == num_photos, 'The number of photos is not what is expected.'
+
+
+def load_photo_table(filename, verbose=1, tag_index=None, chunk_size=1 << 20):
+    """ Reads data into flat arrays, without building any Photo object.
+    :param filename: File containing data about photos.
+    :param verbose: Verbose purposes. Set it to 0 in order to silent everything.
+    :param tag_index: TagIndex used to intern the tags. A new one is used if None.
+    :param chunk_size: Number of characters read at a time.
+    :return: PhotoTable
+    """
+    tag_index = TagIndex() if tag_index is None else tag_index
+    orientations = array('b')
+    indptr = array('q', [0])
+    indices = array('i')
+    for orientation, tags in iter_photos(filename, tag_index=tag_index, chunk_size=chunk_size):
+        orientations.append(orientation == 'V')
+        indices.extend(tags)
+        indptr.append(len(indices))
+
+    table = PhotoTable(np.frombuffer(orientations, dtype=np.int8).astype(np.uint8),
+                       np.frombuffer(indptr, dtype=np.int64),
+                       np.frombuffer(indices, dtype=np.int32),
+                       num_tags=len(tag_index))
+    print(len(table), 'photos caught.') if verbose >= 1 else 0
+    return table
+
+
+def load_data(filename, verbose=1, tag_index=None, lazy=False):
+    """ Reads data.
+    :param filename: File containing data about photos.
+    :param verbose: Verbose purposes. Set it to 0 in order to silent everything.
+    :param tag_index: TagIndex used to intern the tags. A new one is used if None.
+    :param lazy: If True, returns a generator of Photo instead of a list, for files too large to be materialized.
+    :return: list of Photo described in the specified file, tags being interned as integer ids.
+    """
+    photos = (Photo(orientation, set(tags)) for orientation, tags in iter_photos(filename, tag_index=tag_index))
+    if lazy:
+        return photos
 
-    assert true_num_photos == len(photos), 'The number of photos is not what is expected.'
+    photos = list(photos)
     print(len(photos), 'photos caught.') if verbose >= 1 else 0
     return photos
 
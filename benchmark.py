@@ -0,0 +1,310 @@
+""" Benchmark of the solvers : score, wall time, peak memory and time spent in every phase.
+
+Every (solver, dataset) run happens in a fresh process, with fixed seeds, so that peak RSS is its own.
+Phases :
+- load : load_dataset (photos and slides, read from the binary cache, which is built beforehand),
+- form_slides : preparation of the solver (Slide objects, slide pools, transition graphs, policies...),
+- search : create_slideshow,
+- scoring : score_slideshow of the result, every transition being scored again.
+
+Usage :
+    python benchmark.py                                   # Every solver on every file of data/
+    python benchmark.py --solvers greedy uct --data data/c_memorable_moments.txt
+    python benchmark.py --save-baseline                   # Stores the results as the new baseline
+    python benchmark.py --trace benchmarks/traces         # Also profiles every run (see profiling.py)
+The results are written to benchmarks/results.json and benchmarks/results.csv, and compared to
+benchmarks/baseline.json : the exit code is 1 if a run got a lower score, or got slower or bigger than the
+tolerances allow. Runs stopped by the wall clock (budget, timed solvers) get a score different on every machine :
+their score may be up to --score-tolerance lower than the baseline.
+"""
+from base import *
+from dataset import *
+from pairing import *
+from profiling import PROFILER
+
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+import argparse
+import csv
+import glob
+import json
+import multiprocessing as mp
+import os
+import random
+import resource
+import sys
+import time
+
+import numpy as np
+
+
+BENCHMARK_DIR = 'benchmarks'
+PHASES = ('load', 'form_slides', 'search', 'scoring')
+
+
+###########################################
+# Solvers
+###########################################
+# Every solver is described by a setup function (form_slides phase) and a search function (search phase),
+# along with its default parameters.
+
+def _setup_slides(filename, dataset, params):
+    return list(dataset.slides)
+
+
+def _setup_slides_graph(filename, dataset, params):
+    graph = dataset.transition_graph(k=params['knn']) if params['knn'] > 0 else None
+    return list(dataset.slides), graph
+
+
+def _search_greedy(prepared, dataset, params):
+    from algos.greedy import GreedySolution
+    slides, graph = prepared
+    return GreedySolution().create_slideshow(slides, max_candidates=params['max_candidates'], store=dataset.store,
+                                             graph=graph)
+
+
+def _search_random(slides, dataset, params):
+    from algos.random_order import RandomSolution
+    return RandomSolution().create_slideshow(slides, num_iters=params['num_iters'])
+
+
+def _search_ucb(prepared, dataset, params):
+    from algos.ucb import UCBSolution
+    slides, graph = prepared
+    return UCBSolution().create_slideshow(slides, max_candidates=params['max_candidates'],
+                                          ucb_constant=params['ucb_constant'], store=dataset.store,
+                                          budget=params['budget'], graph=graph)
+
+
+def _setup_solver(class_path, **keys):
+    """ Setup function building the solver class_path ('module.Class') with the given parameters. """
+    def setup(filename, dataset, params):
+        module, name = class_path.rsplit('.', 1)
+        cls = getattr(__import__(module, fromlist=[name]), name)
+        return cls(filename, **{k: params[k] for k in keys.get('init', ())})
+    return setup
+
+
+def _search_solver(*keys):
+    """ Search function calling create_slideshow with the given parameters. """
+    def search(solver, dataset, params):
+        return solver.create_slideshow(**{k: params[k] for k in keys})
+    return search
+
+
+SOLVERS = {
+    'greedy': (_setup_slides_graph, _search_greedy, {'max_candidates': 100, 'knn': DEFAULT_K}),
+    'random': (_setup_slides, _search_random, {'num_iters': 3}),
+    'ucb': (_setup_slides_graph, _search_ucb, {'max_candidates': 10, 'ucb_constant': 0.7, 'budget': 30,
+                                               'knn': DEFAULT_K}),
+    # Runs happen in daemonic worker processes, which cannot start worker processes of their own : n_jobs is 1
+    'multistart': (_setup_solver('algos.multistart.MultiStartGreedy', init=('max_candidates', 'knn', 'noise', 'n_jobs')),
+                   _search_solver('num_starts', 'budget'),
+                   {'max_candidates': 100, 'knn': DEFAULT_K, 'noise': 0.5, 'n_jobs': 1, 'num_starts': 8,
+                    'budget': 30}),
+    'nrpa': (_setup_solver('algos.nrpas.NRPASolution', init=('max_slides', 'N', 'knn')),
+             _search_solver('n', 'stabilized'),
+             {'max_slides': 200, 'N': 20, 'n': 2, 'stabilized': False, 'knn': DEFAULT_K}),
+    'snrpa': (_setup_solver('algos.nrpas.NRPASolution', init=('max_slides', 'N', 'P', 'knn')),
+              _search_solver('n', 'stabilized'),
+              {'max_slides': 200, 'N': 10, 'P': 5, 'n': 2, 'stabilized': True, 'knn': DEFAULT_K}),
+    'nested': (_setup_solver('algos.nested.NestedMCSolution', init=('max_slides', 'knn')),
+               _search_solver('n'), {'max_slides': 200, 'n': 1, 'knn': DEFAULT_K}),
+    'uct': (_setup_solver('algos.uct.UCT', init=('max_slides', 'knn')),
+            _search_solver('n', 'c'), {'max_slides': 200, 'n': 100, 'c': 3.4, 'knn': DEFAULT_K}),
+    'nrpa_timed': (_setup_solver('algos.nrpasTimed.NRPASolutionTimed', init=('max_slides',)),
+                   _search_solver('n', 'monitor_time', 'delay'),
+                   {'max_slides': 200, 'n': 3, 'monitor_time': True, 'delay': 5}),
+    'snrpa_timed': (_setup_solver('algos.nrpasTimed.NRPASolutionTimed', init=('max_slides',)),
+                    _search_solver('n', 'stabilized', 'monitor_time', 'delay'),
+                    {'max_slides': 200, 'n': 3, 'stabilized': True, 'monitor_time': True, 'delay': 5}),
+    'nested_timed': (_setup_solver('algos.nmcsTimed.NestedMCSolutionTimed', init=('max_slides',)),
+                     _search_solver('n', 'monitor_time', 'delay'),
+                     {'max_slides': 200, 'n': 3, 'monitor_time': True, 'delay': 5}),
+}
+
+
+###########################################
+# Runs
+###########################################
+
+def peak_rss_mb():
+    """ Peak resident set size of the current process, in MB. """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / (1 << 10)  # Bytes on macOS, KB elsewhere
+
+
+def run_case(solver, filename, seed=0, pairing=DEFAULT_PAIRING, params=None, quiet=True, trace_dir=None):
+    """ Runs a solver on a dataset and measures it. Meant to run in its own process (see benchmark).
+    :param trace_dir: If given, the run is profiled and its trace is written to trace_dir/<solver>-<dataset>.json.
+    :return: dict (solver, dataset, seed, pairing, params, score, wall_time, peak_rss_mb, phases),
+    plus the counters of the profiler if the run is profiled.
+    """
+    setup, search, defaults = SOLVERS[solver]
+    params = dict(defaults, **(params or {}))
+    random.seed(seed)
+    np.random.seed(seed)
+    phases = {}
+
+    @contextmanager
+    def phase(name):
+        with PROFILER.span(name):
+            ts = time.perf_counter()
+            yield
+            phases[name] = time.perf_counter() - ts
+
+    if trace_dir is not None:
+        PROFILER.enable()
+
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull if quiet else sys.stdout), \
+            redirect_stderr(devnull if quiet else sys.stderr):
+        ts = time.perf_counter()
+        with phase('load'):
+            dataset = load_dataset(filename, pairing=pairing)
+        with phase('form_slides'):
+            prepared = setup(filename, dataset, params)
+        with phase('search'):
+            slideshow = search(prepared, dataset, params)
+        with phase('scoring'):
+            score = score_slideshow(slideshow, rescan=True)
+        wall_time = time.perf_counter() - ts
+    result = {'solver': solver, 'dataset': os.path.basename(filename), 'seed': seed, 'pairing': pairing,
+              'params': params, 'score': int(score), 'wall_time': wall_time, 'peak_rss_mb': peak_rss_mb(),
+              'phases': phases}
+    if trace_dir is not None:
+        PROFILER.disable()
+        name = os.path.splitext(result['dataset'])[0]
+        PROFILER.export_trace(os.path.join(trace_dir, f'{solver}-{name}.json'))
+        result['counters'] = dict(PROFILER.counters)
+    return result
+
+
+def benchmark(solvers, filenames, seed=0, pairing=DEFAULT_PAIRING, trace_dir=None, verbose=1):
+    """ Runs every solver on every dataset, each run in a fresh process. """
+    for filename in filenames:
+        # Builds the binary cache (transition graph included), so that the load phase always reads it
+        load_dataset(filename, verbose=0, pairing=pairing).transition_graph(n_jobs=os.cpu_count(), verbose=0)
+    ctx = mp.get_context('spawn')
+    results = []
+    for filename in filenames:
+        for solver in solvers:
+            pool = ctx.Pool(1)
+            try:
+                result = pool.apply(run_case, (solver, filename), {'seed': seed, 'pairing': pairing,
+                                                                     'trace_dir': trace_dir})
+            finally:
+                # Lets the worker exit normally (terminating it would leak its semaphores)
+                pool.close()
+                pool.join()
+            results.append(result)
+            if verbose > 0:
+                print(f"{solver:>14} {result['dataset']:>26} : score {result['score']:>7}  "
+                      f"{result['wall_time']:8.2f} sec  {result['peak_rss_mb']:7.1f} MB  "
+                      + '  '.join(f"{p} {result['phases'][p]:.2f}" for p in PHASES))
+    return results
+
+
+###########################################
+# Results
+###########################################
+
+def save_json(results, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_csv(results, path):
+    """ One row per run, phases flattened as phase_<name> columns. """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    columns = ['solver', 'dataset', 'seed', 'pairing', 'score', 'wall_time', 'peak_rss_mb'] + \
+              [f'phase_{p}' for p in PHASES] + ['params']
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for r in results:
+            row = {c: r[c] for c in columns if c in r}
+            row.update({f'phase_{p}': r['phases'].get(p) for p in PHASES})
+            row['params'] = json.dumps(r['params'], sort_keys=True)
+            writer.writerow(row)
+
+
+def is_budgeted(params):
+    """ True if a run is stopped by the wall clock (budget, or delay with monitor_time) : its score depends on
+    the speed of the machine, even with fixed seeds.
+    """
+    return params.get('budget') is not None or params.get('monitor_time', False)
+
+
+def compare(results, baseline, time_tolerance=0.5, memory_tolerance=0.25, min_time=1.0, score_tolerance=0.05):
+    """ Regressions of results with respect to baseline, for the runs present in both.
+    A run regresses if its score is lower (more than score_tolerance (relative) lower for budgeted runs,
+    see is_budgeted), if its wall time is more than time_tolerance (relative) and min_time seconds above
+    the baseline, or if its peak RSS is more than memory_tolerance (relative) above it.
+    :return: list of str describing the regressions.
+    """
+    reference = {(r['solver'], r['dataset'], r['seed'], r['pairing']): r for r in baseline}
+    regressions = []
+    for r in results:
+        b = reference.get((r['solver'], r['dataset'], r['seed'], r['pairing']))
+        if b is None or b['params'] != r['params']:
+            continue
+        name = f"{r['solver']} on {r['dataset']}"
+        min_score = b['score'] * (1 - score_tolerance) if is_budgeted(r['params']) else b['score']
+        if r['score'] < min_score:
+            regressions.append(f"{name} : score {r['score']} < {b['score']}")
+        if r['wall_time'] > b['wall_time'] * (1 + time_tolerance) and r['wall_time'] > b['wall_time'] + min_time:
+            regressions.append(f"{name} : wall time {r['wall_time']:.2f} sec > {b['wall_time']:.2f} sec")
+        if r['peak_rss_mb'] > b['peak_rss_mb'] * (1 + memory_tolerance):
+            regressions.append(f"{name} : peak RSS {r['peak_rss_mb']:.1f} MB > {b['peak_rss_mb']:.1f} MB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the slideshow solvers.')
+    parser.add_argument('--solvers', nargs='+', default=list(SOLVERS), choices=list(SOLVERS))
+    parser.add_argument('--data', nargs='+', default=sorted(glob.glob(os.path.join('data', '*.txt'))),
+                        help='Datasets (default : every file of data/).')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pairing', default=DEFAULT_PAIRING, choices=list(PAIRINGS))
+    parser.add_argument('--out', default=os.path.join(BENCHMARK_DIR, 'results'),
+                        help='Path of the results, without extension (.json and .csv are written).')
+    parser.add_argument('--baseline', default=os.path.join(BENCHMARK_DIR, 'baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true', help='Stores the results as the baseline.')
+    parser.add_argument('--time-tolerance', type=float, default=0.5)
+    parser.add_argument('--memory-tolerance', type=float, default=0.25)
+    parser.add_argument('--score-tolerance', type=float, default=0.05,
+                        help='Relative score drop allowed for the runs stopped by the wall clock (default : 0.05).')
+    parser.add_argument('--trace', default=None, metavar='DIR',
+                        help='Profiles the runs and writes their JSON traces to DIR (timings include the profiling).')
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.solvers, args.data, seed=args.seed, pairing=args.pairing, trace_dir=args.trace)
+    save_json(results, args.out + '.json')
+    save_csv(results, args.out + '.csv')
+    if args.save_baseline:
+        # Runs missing from the new results are kept
+        baseline = load_json(args.baseline) if os.path.exists(args.baseline) else []
+        keys = {(r['solver'], r['dataset'], r['seed'], r['pairing']) for r in results}
+        baseline = [b for b in baseline if (b['solver'], b['dataset'], b['seed'], b['pairing']) not in keys]
+        save_json(baseline + results, args.baseline)
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}, nothing to compare.')
+        return 0
+    regressions = compare(results, load_json(args.baseline), time_tolerance=args.time_tolerance,
+                          memory_tolerance=args.memory_tolerance, score_tolerance=args.score_tolerance)
+    for regression in regressions:
+        print('REGRESSION', regression)
+    print(f'{len(regressions)} regression(s) against {args.baseline}')
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+from base import *
+from knn import ScoreBlocks
+
+import numpy as np
+
+
+class UpperBound(ScoreBlocks):
+    """
+    Upper bounds on the score of any slideshow made of a set of slides, to know how far a solution is from optimal.
+    All of them come from sweeps over the transition scores of all the pairs of slides (see knn.ScoreBlocks) :
+    - top1_bound : every slide but the last one has a successor, scoring at most its best transition,
+    - top2_bound : every slide has at most two neighbors, scoring at most its two best transitions,
+      and every transition is counted from both of its slides,
+    - matching_bound : dual of the fractional 2-matching relaxation (every slide has at most two neighbors),
+      refined by a few sweeps, and capped by top1_bound and top2_bound : the tightest of the three.
+    A slideshow cannot score more than the bound : a solver reaching it is optimal.
+    """
+
+    def __init__(self, store, slide_ids=None, chunk_size=512, n_jobs=1):
+        """
+        :param store: SlideStore of the slides.
+        :param slide_ids: Indexes of the slides of the slideshow. All the slides of the store if None.
+        :param chunk_size: Number of rows of the blocks of transition scores.
+        :param n_jobs: Number of worker processes computing the blocks.
+        """
+        super().__init__(store, slide_ids=slide_ids, chunk_size=chunk_size, n_jobs=n_jobs)
+        self.best = None  # Scores of the two best transitions of every slide
+        self.y = None  # Current dual solution of matching_bound
+
+    def best_transitions(self):
+        """ int array of shape (num_slides, 2) : the two best transition scores of every slide (0 if there are none). """
+        if self.best is None:
+            self.best = np.concatenate([scores for _, scores in self.sweep('top_k', 2)]).astype(np.int64)
+        return self.best
+
+    def top1_bound(self):
+        if len(self.slide_ids) < 2:
+            return 0
+        best = self.best_transitions()[:, 0]
+        return int(best.sum() - best.min())
+
+    def top2_bound(self):
+        if len(self.slide_ids) < 2:
+            return 0
+        best = self.best_transitions()
+        # Both ends of the slideshow have a single neighbor
+        return int((best.sum() - np.sort(best[:, 1])[:2].sum()) // 2)
+
+    def _matching_block(self, start):
+        # Reduced scores w_ij - y_j of the block, the third best of every row, and the excess over y_i + y_j
+        y = self.y.astype(np.float32)
+        reduced = self.block(start).astype(np.float32)
+        reduced -= y[None, :]
+        third = np.partition(reduced, -3, axis=1)[:, -3].copy()  # Not a view, which would keep the block alive
+        reduced -= y[start:start+self.chunk_size, None]
+        excess = np.maximum(reduced, 0, out=reduced).sum(dtype=np.float64)
+        return third, excess
+
+    def matching_bound(self, passes=3):
+        """ Bound from the dual of the fractional 2-matching relaxation of the slideshow :
+        for any y >= 0, score <= 2 * sum(y) + sum over pairs (i, j) of max(w_ij - y_i - y_j, 0).
+        Starting from y_i = half the best transition of i (which gives top1_bound without its correction),
+        every pass evaluates the bound and moves y towards its coordinate-wise optimum, the third best
+        reduced score w_ij - y_j of every slide. Every pass costs a sweep.
+        A few passes do not always bring the dual below top2_bound : the bound is capped by both.
+        :return: The best bound found, never above top1_bound nor top2_bound.
+        """
+        bound = min(self.top1_bound(), self.top2_bound())
+        if len(self.slide_ids) < 4:
+            return bound
+        self.y = self.best_transitions()[:, 0] / 2
+        for _ in range(passes):
+            results = self.sweep('_matching_block')
+            excess = sum(r[1] for r in results) / 2  # Every pair is counted twice
+            bound = min(bound, int(np.floor(2 * self.y.sum() + excess + 1e-6)))
+            third = np.concatenate([r[0] for r in results])
+            self.y = (self.y + np.maximum(third, 0)) / 2
+        return bound
+
+    def bound(self, method='top2', **kwargs):
+        """ Best bound among top1_bound and, with method='top2', top2_bound. With method='matching', matching_bound,
+        which is already capped by both.
+        """
+        assert method in ('top1', 'top2', 'matching'), f"Unknown bound '{method}'."
+        if method == 'matching':
+            return self.matching_bound(**kwargs)
+        bound = self.top1_bound()
+        if method == 'top2':
+            bound = min(bound, self.top2_bound())
+        return bound
+
+
+def upper_bound(store, slide_ids=None, method='top2', chunk_size=512, n_jobs=1, **kwargs):
+    """ Upper bound on the score of any slideshow of the given slides, see UpperBound. """
+    return UpperBound(store, slide_ids=slide_ids, chunk_size=chunk_size, n_jobs=n_jobs).bound(method, **kwargs)
+
+
+if __name__ == '__main__':
+    from dataset import load_dataset
+    filename = "data/c_memorable_moments.txt"
+    dataset = load_dataset(filename)
+    bounds = UpperBound(dataset.store)
+    print(f'Top 1 bound : {bounds.top1_bound()}')
+    print(f'Top 2 bound : {bounds.top2_bound()}')
+    print(f'Matching bound : {bounds.matching_bound()}')
@@ -0,0 +1,201 @@
+from base import *
+from knn import *
+from pairing import *
+
+from collections.abc import Sequence
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+
+CACHE_VERSION = 2
+CACHE_DIRNAME = '.cache'
+
+
+class SlideList(Sequence):
+    """
+    Read-only list of the Slide objects of a dataset.
+    Slides (and their photos) are only built when they are accessed, then kept.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self._slides = [None] * len(dataset.content)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        slide = self._slides[idx]
+        if slide is None:
+            slide = Slide(*[self.dataset.get_photo(p) for p in self.dataset.content[idx] if p >= 0])
+            self._slides[idx] = slide
+        return slide
+
+    def __len__(self):
+        return len(self._slides)
+
+
+class Dataset:
+    """
+    A parsed dataset :
+    - photos : PhotoTable,
+    - content : int array of shape (num_slides, 2), the photos of every slide (-1 if there is none),
+    - store : SlideStore of the slides,
+    - tag_names : name of every tag id.
+    Arrays may be memory-mapped from the binary cache, whose directory (for these slides) is cache_path.
+    """
+
+    def __init__(self, photos, content, store, tag_names, cache_path=None):
+        self.photos = photos
+        self.content = content
+        self.store = store
+        self.tag_names = tag_names
+        self.cache_path = cache_path
+        self.slides = SlideList(self)
+        self._photos = {}
+
+    def get_photo(self, idx_photo):
+        photo = self._photos.get(idx_photo)
+        if photo is None:
+            orientation = 'V' if self.photos.is_vertical(idx_photo) else 'H'
+            photo = Photo(orientation, set(self.photos.get_tags(idx_photo).tolist()))
+            self._photos[idx_photo] = photo
+        return photo
+
+    def transition_graph(self, k=DEFAULT_K, slide_ids=None, n_jobs=1, verbose=1):
+        """ k-nearest-neighbor graph of the transitions between the slides (see knn.TransitionGraph).
+        The graph of all the slides goes through the cache : it is computed once, then memory-mapped.
+        The graph of a subset of the slides (slide_ids) is computed every time.
+        :param n_jobs: Number of worker processes computing the graph.
+        """
+        if slide_ids is not None and len(slide_ids) < len(self):
+            return build_transition_graph(self.store, k=k, slide_ids=slide_ids, n_jobs=n_jobs)
+        path = os.path.join(self.cache_path, f'knn-{k}') if self.cache_path is not None else None
+        cached = _read_arrays(path, ['neighbors', 'scores']) if path is not None else None
+        if cached is not None:
+            arrays, _ = cached
+            print('Transition graph caught from cache.') if verbose >= 1 else 0
+        else:
+            graph = build_transition_graph(self.store, k=k, n_jobs=n_jobs)
+            arrays = {'neighbors': graph.neighbors, 'scores': graph.scores}
+            _write_arrays(path, arrays, meta={'k': k}) if path is not None else 0
+        return TransitionGraph(arrays['neighbors'], arrays['scores'])
+
+    def __len__(self):
+        return len(self.content)
+
+
+###########################################
+# Binary cache
+###########################################
+
+def file_hash(filename, chunk_size=1 << 20):
+    """ sha1 of the content of a file. """
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_cache_path(filename, cache_dir=None):
+    """ Directory holding the compiled version of filename.
+    By default, it is a .cache directory next to the dataset, keyed by the hash of the file content
+    and the version of the cache format.
+    """
+    cache_dir = os.path.join(os.path.dirname(filename), CACHE_DIRNAME) if cache_dir is None else cache_dir
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(cache_dir, f'{name}-{file_hash(filename)[:16]}-v{CACHE_VERSION}')
+
+
+def _write_arrays(path, arrays, meta=None):
+    """ Atomically writes one .npy file per array (and a meta.json) into the directory path. """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path))
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp_path, name + '.npy'), arr)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(dict(meta or {}, version=CACHE_VERSION), f)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # Another process wrote it first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def _read_arrays(path, names):
+    """ Memory-maps the arrays written by _write_arrays. Returns None if path is missing or outdated. """
+    try:
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        if meta.get('version') != CACHE_VERSION:
+            return None
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in names}
+    except (OSError, ValueError):
+        return None
+    return arrays, meta
+
+
+@PROFILER.traced('compile_photos')
+def compile_photos(filename, verbose=1):
+    """ Parses filename and returns the arrays to store in the cache. """
+    tag_index = TagIndex()
+    table = load_photo_table(filename, verbose=verbose, tag_index=tag_index)
+    return {'orientations': table.orientations, 'photo_indptr': table.indptr, 'photo_indices': table.indices,
+            'tag_names': np.array(tag_index.names, dtype=str)}
+
+
+@PROFILER.traced('compile_slides')
+def compile_slides(table, pairing=DEFAULT_PAIRING):
+    """ Forms the slides of table and returns the arrays to store in the cache. """
+    content = pair_photos(table, pairing=pairing)
+    store = SlideStore.from_photo_table(table, content)
+    return {'content': content, 'slide_indptr': store.indptr, 'slide_indices': store.indices}
+
+
+@PROFILER.traced('load_dataset')
+def load_dataset(filename, verbose=1, cache_dir=None, use_cache=True, pairing=DEFAULT_PAIRING):
+    """ Loads a dataset and forms its slides, going through the binary cache.
+    The first load parses the text file and writes the cache, the next ones memory-map it.
+    Slides are cached separately for every pairing strategy.
+    :param filename: File containing data about photos.
+    :param verbose: Verbose purposes. Set it to 0 in order to silent everything.
+    :param cache_dir: Directory of the cache. Defaults to a .cache directory next to the dataset.
+    :param use_cache: If False, neither reads nor writes the cache.
+    :param pairing: Strategy used to pair vertical photos, see pairing.PAIRINGS.
+    :return: Dataset
+    """
+    path = get_cache_path(filename, cache_dir=cache_dir) if use_cache else None
+    slides_path = os.path.join(path, f'slides-{pairing}') if use_cache else None
+    photo_names = ['orientations', 'photo_indptr', 'photo_indices', 'tag_names']
+    slide_names = ['content', 'slide_indptr', 'slide_indices']
+
+    cached = _read_arrays(path, photo_names) if use_cache else None
+    if cached is not None:
+        arrays, meta = cached
+        print(f'{len(arrays["orientations"])} photos caught from cache.') if verbose >= 1 else 0
+    else:
+        arrays = compile_photos(filename, verbose=verbose)
+        meta = {'num_tags': len(arrays['tag_names'])}
+        _write_arrays(path, arrays, meta=meta) if use_cache else 0
+    num_tags = meta['num_tags']
+    photos = PhotoTable(arrays['orientations'], arrays['photo_indptr'], arrays['photo_indices'], num_tags=num_tags)
+
+    cached = _read_arrays(slides_path, slide_names) if use_cache else None
+    if cached is not None:
+        slide_arrays, _ = cached
+    else:
+        slide_arrays = compile_slides(photos, pairing=pairing)
+        _write_arrays(slides_path, slide_arrays, meta={'pairing': pairing}) if use_cache else 0
+
+    store = SlideStore(slide_arrays['slide_indptr'], slide_arrays['slide_indices'], num_tags=num_tags)
+    return Dataset(photos, slide_arrays['content'], store, arrays['tag_names'], cache_path=slides_path)
+
+
+if __name__ == '__main__':
+    filename = "data/d_pet_pictures.txt"
+    dataset = load_dataset(filename)
+    print(f'Num slides : {len(dataset)}')
+    print(dataset.slides[0])
@@ -0,0 +1,192 @@
+from base import *
+from parallel import *
+from profiling import PROFILER
+
+import numpy as np
+import random
+
+
+DEFAULT_K = 16
+
+
+###########################################
+# Worker processes
+###########################################
+
+def _block_worker(args):
+    method, start, method_args = args
+    return getattr(get_worker_solution(), method)(start, *method_args)
+
+
+class ScoreBlocks:
+    """
+    Sweeps over the transition scores of all the pairs of a set of slides, computed block by block
+    (chunk_size rows at a time) with SlideStore.score_block, possibly in n_jobs worker processes.
+    Every block is reduced by a method of the object (e.g. top_k) and only the reductions are kept,
+    so that the full matrix of scores is never held in memory.
+    """
+
+    def __init__(self, store, slide_ids=None, chunk_size=512, n_jobs=1):
+        """
+        :param store: SlideStore of the slides.
+        :param slide_ids: Indexes of the slides. All the slides of the store if None.
+        :param chunk_size: Number of rows of the blocks of transition scores.
+        :param n_jobs: Number of worker processes computing the blocks.
+        """
+        self.store = store
+        self.slide_ids = np.arange(len(store)) if slide_ids is None else np.asarray(slide_ids, dtype=np.int64)
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+        self.cols_tags = store.block_columns(self.slide_ids)
+        self.workers = None  # Process pool, only alive during a sweep
+
+    def block(self, start):
+        """ Transition scores from the slides start to start + chunk_size to all the slides, -1 from a slide to itself. """
+        rows = self.slide_ids[start:start+self.chunk_size]
+        scores = self.store.score_block(rows, self.slide_ids, cols_tags=self.cols_tags)
+        scores[np.arange(len(rows)), start + np.arange(len(rows))] = -1
+        return scores
+
+    def sweep(self, method, *args):
+        """ Results of method(start, *args) for every block, in order. """
+        starts = range(0, len(self.slide_ids), self.chunk_size)
+        with PROFILER.span('blocks.sweep', method=method), worker_pool(self, self.n_jobs):
+            if self.workers is not None:
+                return self.workers.map(_block_worker, [(method, start, args) for start in starts])
+            return [getattr(self, method)(start, *args) for start in starts]
+
+    def top_k(self, start, k):
+        """ The k best transitions from every slide of a block, by decreasing score.
+        :return: (neighbors, scores) : int32 slide indexes (-1 where the score is not positive)
+        and int8 scores, both of shape (num_rows, k).
+        """
+        scores = self.block(start)
+        num_rows, num_cols = scores.shape
+        neighbors = np.full((num_rows, k), -1, dtype=np.int32)
+        best = np.zeros((num_rows, k), dtype=np.int8)
+        kk = min(k, num_cols)
+        if kk == 0:
+            return neighbors, best
+        top = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+        neighbors[:, :kk] = np.where(top_scores > 0, self.slide_ids[top], -1)
+        best[:, :kk] = top_scores.clip(0, np.iinfo(np.int8).max)
+        return neighbors, best
+
+
+class TransitionGraph:
+    """
+    Sparse k-nearest-neighbor graph of the transitions : the k best successors of every slide, precomputed once.
+    - neighbors : int32 array of shape (num_slides, k), slide indexes by decreasing transition score,
+      -1 once there are no more slides with a positive score,
+    - scores : int8 array of shape (num_slides, k), the transition scores.
+    Transition scores are symmetric : successors are also the best predecessors.
+    Solvers draw their candidate moves from the successors of the last slide that are still available,
+    instead of the first slides by number of tags.
+    The graph of a subset of the slides (slide_ids) only has the rows of these slides, in their order.
+    """
+
+    def __init__(self, neighbors, scores, slide_ids=None):
+        self.neighbors = neighbors
+        self.scores = scores
+        # Row of every slide, None if row i is the slide i
+        self.rows = None if slide_ids is None else {int(idx_slide): i for i, idx_slide in enumerate(slide_ids)}
+        self._successors = {}  # Lists of successors of the rows read so far
+
+    def row(self, idx_slide):
+        return idx_slide if self.rows is None else self.rows[idx_slide]
+
+    @property
+    def k(self):
+        return self.neighbors.shape[1]
+
+    def successors(self, idx_slide):
+        """ List of the successors of a slide, best first. """
+        successors = self._successors.get(idx_slide)
+        if successors is None:
+            row = self.neighbors[self.row(idx_slide)]
+            successors = self._successors[idx_slide] = row[row >= 0].tolist()
+        return successors
+
+    def best_available(self, idx_slide, pool, noise=0.):
+        """ Best successor of idx_slide still in pool (SlidePool), None if all of them are used.
+        :param noise: Successors are compared on their score plus a uniform noise in [0, noise) :
+        below 1, it only breaks ties at random.
+        """
+        if noise <= 0:
+            for s in self.successors(idx_slide):
+                if s in pool:
+                    return s
+            return None
+        best, best_score = None, float('-inf')
+        for s, score in zip(self.successors(idx_slide), self.scores[self.row(idx_slide)].tolist()):
+            if score + noise <= best_score:
+                # Successors are sorted by decreasing score : none of the next ones can win
+                break
+            if s in pool:
+                score += random.random() * noise
+                if score > best_score:
+                    best, best_score = s, score
+        return best
+
+    def legal_moves(self, last, pool, k):
+        """ The first k successors of last still in pool, completed with the first slides of the pool.
+        :param last: Last slide of the slideshow, None if it is empty.
+        :param pool: SlidePool of the remaining slides.
+        """
+        moves = [s for s in self.successors(last) if s in pool][:k] if last is not None else []
+        idx_slide = pool.next[pool.head]
+        while len(moves) < k and idx_slide != pool.head:
+            if idx_slide not in moves:
+                moves.append(idx_slide)
+            idx_slide = pool.next[idx_slide]
+        return moves
+
+    def playout(self, last, pool, k, score_transition):
+        """ Random completion of a slideshow, every move drawn uniformly among legal_moves. pool is left unchanged.
+        :param score_transition: Function giving the score of a transition between two slides.
+        :return: (score of the transitions added, list of the moves)
+        """
+        pool = pool.copy()
+        score, moves = 0, []
+        while len(pool) > 0:
+            move = random.choice(self.legal_moves(last, pool, k))
+            pool.remove(move)
+            score += score_transition(last, move) if last is not None else 0
+            moves.append(move)
+            last = move
+        return score, moves
+
+    def __len__(self):
+        return len(self.neighbors)
+
+
+@PROFILER.traced('build_transition_graph')
+def build_transition_graph(store, k=DEFAULT_K, slide_ids=None, chunk_size=512, n_jobs=1):
+    """ Computes the k-nearest-neighbor graph of the transitions between slides.
+    :param store: SlideStore of the slides.
+    :param k: Number of successors of every slide.
+    :param slide_ids: Indexes of the slides of the graph, all the slides of the store if None.
+    Successors are taken among them, and the graph only has their rows.
+    :param chunk_size: Number of rows of the blocks of transition scores.
+    :param n_jobs: Number of worker processes.
+    :return: TransitionGraph
+    """
+    blocks = ScoreBlocks(store, slide_ids=slide_ids, chunk_size=chunk_size, n_jobs=n_jobs)
+    results = blocks.sweep('top_k', k)
+    if len(results) == 0:
+        return TransitionGraph(np.full((0, k), -1, dtype=np.int32), np.zeros((0, k), dtype=np.int8), slide_ids=())
+    neighbors = np.concatenate([r[0] for r in results])
+    scores = np.concatenate([r[1] for r in results])
+    return TransitionGraph(neighbors, scores, slide_ids=slide_ids)
+
+
+if __name__ == '__main__':
+    from dataset import load_dataset
+    filename = "data/c_memorable_moments.txt"
+    dataset = load_dataset(filename)
+    graph = dataset.transition_graph()
+    print(f'{len(graph)} slides, {graph.k} successors per slide')
+    print(f'Successors of slide 0 : {graph.successors(0)}')
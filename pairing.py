@@ -0,0 +1,88 @@
+from base import *
+
+
+###########################################
+# Vertical photos pairing
+###########################################
+# Every strategy takes a PhotoTable and returns an int array of shape (num_slides, 2) :
+# the photos of every slide, -1 standing for "no photo" in horizontal slides.
+
+def _with_horizontals(table, pairs):
+    """ Slides made of the horizontal photos, in file order, followed by the given vertical pairs. """
+    horizontals = np.flatnonzero(table.orientations == 0)
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    return np.concatenate([np.stack([horizontals, np.full(len(horizontals), -1)], axis=1), pairs])
+
+
+def _verticals(table):
+    verticals = np.flatnonzero(table.orientations == 1)
+    assert len(verticals) % 2 == 0, f"One vertical photo remains... Kinda strange."
+    return verticals
+
+
+def pair_sequentially(table):
+    """ Naive slide formation where vertical photos are paired sequentially as they are read.
+    Slides come in file order, as with the historical form_slides methods of the solvers.
+    """
+    content = _with_horizontals(table, _verticals(table))
+    # A slide is formed when its last photo is read
+    return content[np.argsort(content.max(axis=1), kind='stable')]
+
+
+def pair_balanced(table):
+    """ Pairs the vertical photo having the most tags with the one having the least, and so on,
+    so that vertical slides have balanced numbers of tags. O(n log n).
+    """
+    verticals = _verticals(table)
+    sizes = np.diff(table.indptr)[verticals]
+    by_size = verticals[np.argsort(-sizes, kind='stable')]
+    half = len(by_size) // 2
+    return _with_horizontals(table, np.stack([by_size[:half], by_size[half:][::-1]], axis=1))
+
+
+def pair_greedy(table, window=100):
+    """ Greedy matching maximizing the number of tags of vertical slides.
+    Vertical photos are taken by decreasing number of tags, and each one is paired with the photo,
+    among the next window unpaired ones, sharing the fewest tags with it (the first one on ties).
+    Common tags are counted on the CSR layout of the table (see SlideStore.count_common). O(n * window).
+    """
+    verticals = _verticals(table)
+    sizes = np.diff(table.indptr)[verticals]
+    by_size = verticals[np.argsort(-sizes, kind='stable')].tolist()
+    # Every photo is a slide of the store
+    store = SlideStore(table.indptr, table.indices, num_tags=table.num_tags)
+
+    pool = SlidePool(by_size)
+    pairs = []
+    while len(pool) > 0:
+        photo = pool.first()
+        pool.remove(photo)
+        candidates = pool.top(window)
+        best = candidates[int(np.argmin(store.count_common(photo, candidates)))]
+        pool.remove(best)
+        pairs.append((photo, best))
+    return _with_horizontals(table, pairs)
+
+
+PAIRINGS = {
+    'sequential': pair_sequentially,
+    'balanced': pair_balanced,
+    'greedy': pair_greedy,
+}
+DEFAULT_PAIRING = 'greedy'
+
+
+def pair_photos(table, pairing=DEFAULT_PAIRING):
+    """ Forms the slides of a PhotoTable with the given pairing strategy (see PAIRINGS). """
+    assert pairing in PAIRINGS, f"Unknown pairing '{pairing}', expected one of {list(PAIRINGS)}."
+    return PAIRINGS[pairing](table)
+
+
+def form_slides(photos, pairing=DEFAULT_PAIRING):
+    """ Forms Slide objects from a list of Photo with the given pairing strategy. """
+    orientations = np.array([photo.is_vertical() for photo in photos], dtype=np.uint8)
+    sizes = np.array([len(photo.get_tags()) for photo in photos], dtype=np.int64)
+    indptr = np.concatenate([[0], np.cumsum(sizes)])
+    indices = np.array([tag for photo in photos for tag in sorted(photo.get_tags())], dtype=np.int32)
+    content = pair_photos(PhotoTable(orientations, indptr, indices), pairing=pairing)
+    return [Slide(*[photos[p] for p in c if p >= 0]) for c in content.tolist()]
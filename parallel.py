@@ -0,0 +1,49 @@
+from contextlib import contextmanager
+import multiprocessing as mp
+import random
+
+import numpy as np
+
+
+###########################################
+# Worker processes
+###########################################
+# Workers are forked with the solution they work for, so that its slides are shared read-only
+# (memory-mapped pages included) instead of being pickled for every task.
+
+_worker_solution = None
+
+
+def _init_worker(solution):
+    global _worker_solution
+    _worker_solution = solution
+    # Forked workers would otherwise share the random state of the parent
+    random.seed()
+    np.random.seed()
+
+
+def get_worker_solution():
+    """ The solution a worker process was started with. """
+    return _worker_solution
+
+
+def seed_worker(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+@contextmanager
+def worker_pool(solution, n_jobs):
+    """ Pool of n_jobs worker processes holding solution, or None if n_jobs <= 1.
+    The pool is stored in solution.workers while it is open.
+    """
+    if n_jobs <= 1:
+        yield None
+        return
+    ctx = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context()
+    with ctx.Pool(n_jobs, initializer=_init_worker, initargs=(solution,)) as workers:
+        solution.workers = workers
+        try:
+            yield workers
+        finally:
+            solution.workers = None
@@ -0,0 +1,73 @@
+from profiling import PROFILER
+
+import numpy as np
+
+
+class Policy:
+    """
+    NRPA policy : one weight per move code, backed by a NumPy array.
+    A move is chosen among the legal ones with probability proportional to exp(weight).
+    Sampling uses the Gumbel-max trick : argmax(weight + Gumbel noise) follows the softmax distribution.
+    """
+
+    def __init__(self, weights):
+        self.weights = np.array(weights, dtype=np.float64)
+
+    def sample(self, codes, noise=None):
+        """ Draws one of the given legal codes.
+        :param noise: Gumbel noise drawn beforehand (e.g. for a whole playout at once), at least len(codes) values.
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        noise = np.random.gumbel(size=len(codes)) if noise is None else noise[:len(codes)]
+        return int(codes[np.argmax(self.weights[codes] + noise)])
+
+    def sample_permutation(self, codes):
+        """ Draws a whole ordering of codes, as if they were drawn one at a time, each among the remaining ones.
+        Sorting by decreasing weight + Gumbel noise gives exactly that distribution (Plackett-Luce), in O(n log n).
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        keys = self.weights[codes] + np.random.gumbel(size=len(codes))
+        return codes[np.argsort(-keys, kind='stable')].tolist()
+
+    def adapt(self, sequence, legal_codes, alpha=1.0):
+        """ NRPA adaptation towards sequence, computed from the current weights.
+        :param sequence: Codes of the moves played.
+        :param legal_codes: For every move of sequence, the codes that were legal when it was played.
+        :param alpha: Learning rate.
+        :return: New Policy.
+        """
+        if PROFILER.enabled:
+            PROFILER.count('policy_updates')
+        width = max((len(codes) for codes in legal_codes), default=0)
+        moves = np.full((len(legal_codes), width), -1, dtype=np.int64)
+        for i, codes in enumerate(legal_codes):
+            moves[i, :len(codes)] = codes
+        legal = moves >= 0
+
+        w = np.where(legal, self.weights[moves], -np.inf)
+        e = np.exp(w - w.max(axis=1, keepdims=True))
+        probs = e / e.sum(axis=1, keepdims=True)
+
+        weights = self.weights.copy()
+        np.add.at(weights, np.asarray(sequence, dtype=np.int64), alpha)
+        np.add.at(weights, moves[legal], -alpha * probs[legal])
+        return Policy(weights)
+
+    def adapt_permutation(self, sequence, alpha=1.0):
+        """ Same as adapt when every remaining code is legal at every step (sequence being all the codes).
+        The legal codes at step i are sequence[i:], so every normalizer is a suffix sum : O(n).
+        Sums are accumulated in log space, which stays finite whatever the spread of the weights.
+        """
+        if PROFILER.enabled:
+            PROFILER.count('policy_updates')
+        sequence = np.asarray(sequence, dtype=np.int64)
+        w = self.weights[sequence]
+        log_z = np.logaddexp.accumulate(w[::-1])[::-1]  # log_z[i] = log of the normalizer at step i
+        # A code played at step j was legal at every step i <= j : its probabilities sum to exp(w_j) * sum(1 / z[:j+1])
+        probs = np.exp(w + np.logaddexp.accumulate(-log_z))
+        weights = self.weights.copy()
+        weights[sequence] += alpha - alpha * probs
+        return Policy(weights)
+
+    def __len__(self):
+        return len(self.weights)
@@ -0,0 +1,165 @@
+""" Instrumentation : nested timed spans and event counters, exported as a JSON trace.
+
+Profiling is disabled by default, and then costs an attribute check per instrumented call :
+    from profiling import PROFILER
+    PROFILER.enable()
+    with PROFILER.span('search', level=2):
+        ...
+        if PROFILER.enabled:
+            PROFILER.count('rollouts')
+    PROFILER.report()
+    PROFILER.export_trace('trace.json')  # Opens in chrome://tracing, Perfetto or speedscope
+
+Counters used by the solvers : rollouts, score_slides, nodes_expanded, policy_updates.
+Only the current process is recorded : spans and counters of worker processes are lost.
+"""
+import functools
+import json
+import os
+import threading
+import time
+
+
+class _NullSpan:
+    """ Span doing nothing, returned while profiling is disabled. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'args', 'start', 'counters')
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.profiler.stack.append(self.name)
+        self.counters = dict(self.profiler.counters)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        profiler = self.profiler
+        path = '/'.join(profiler.stack)
+        profiler.stack.pop()
+        # Counts made during the span
+        counts = {k: v - self.counters.get(k, 0) for k, v in profiler.counters.items() if v != self.counters.get(k, 0)}
+        profiler.events.append((self.name, path, self.start, end - self.start, dict(self.args, **counts)))
+        return False
+
+
+class Profiler:
+    """
+    Records spans (named, nested, timed with perf_counter_ns) and counters while it is enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.events = []  # (name, path, start ns, duration ns, args) of the finished spans
+        self.counters = {}
+        self.stack = []
+        self.origin = time.perf_counter_ns()
+        self.elapsed = 0  # ns spent enabled before the last enable
+        self.enabled_at = self.origin
+
+    def enable(self, reset=True):
+        if reset:
+            self.reset()
+        self.enabled_at = time.perf_counter_ns()
+        self.enabled = True
+
+    def disable(self):
+        if self.enabled:
+            self.elapsed += time.perf_counter_ns() - self.enabled_at
+        self.enabled = False
+
+    def enabled_seconds(self):
+        running = time.perf_counter_ns() - self.enabled_at if self.enabled else 0
+        return (self.elapsed + running) / 1e9
+
+    def span(self, name, **args):
+        """ Context manager timing a (possibly nested) span of code. args are stored with the span. """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def count(self, name, n=1):
+        """ Adds n to a counter. In hot loops, check PROFILER.enabled before calling. """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def traced(self, name=None):
+        """ Decorator recording every call of a function as a span. """
+        def decorator(f):
+            span_name = name or f.__qualname__
+
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return f(*args, **kwargs)
+                with _Span(self, span_name, {}):
+                    return f(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """ Aggregated spans and counters.
+        :return: dict with
+        - spans : for every path of nested span names, its number of calls, total and self time (seconds),
+        - counters : for every counter, its count and its rate per second of enabled time.
+        """
+        spans = {}
+        for _, path, _, duration, _ in self.events:
+            s = spans.setdefault(path, {'calls': 0, 'total': 0., 'self': 0.})
+            s['calls'] += 1
+            s['total'] += duration / 1e9
+            s['self'] += duration / 1e9
+        for path, s in spans.items():
+            parent = path.rpartition('/')[0]
+            if parent in spans:
+                spans[parent]['self'] -= s['total']
+        seconds = self.enabled_seconds()
+        counters = {k: {'count': v, 'per_sec': v / seconds if seconds > 0 else 0.} for k, v in self.counters.items()}
+        return {'seconds': seconds, 'spans': spans, 'counters': counters}
+
+    def report(self):
+        """ Prints the summary. """
+        summary = self.summary()
+        print(f"{'span':<50} {'calls':>8} {'total (s)':>10} {'self (s)':>10}")
+        for path, s in sorted(summary['spans'].items()):
+            print(f"{'  ' * path.count('/') + path.rpartition('/')[2]:<50} {s['calls']:>8} {s['total']:>10.4f} {s['self']:>10.4f}")
+        for name, c in sorted(summary['counters'].items()):
+            print(f"{name:<50} {c['count']:>8} {c['per_sec']:>10.1f}/s")
+
+    def trace(self):
+        """ Trace in the Trace Event Format (complete events for the spans, a counter event per counter). """
+        pid, tid = os.getpid(), threading.get_ident()
+        events = [{'name': name, 'ph': 'X', 'ts': (start - self.origin) / 1e3, 'dur': duration / 1e3,
+                   'pid': pid, 'tid': tid, 'args': args}
+                  for name, _, start, duration, args in self.events]
+        end = max([e['ts'] + e['dur'] for e in events], default=0.)
+        events += [{'name': name, 'ph': 'C', 'ts': end, 'pid': pid, 'tid': tid, 'args': {name: value}}
+                   for name, value in self.counters.items()]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': self.summary()}
+
+    def export_trace(self, path):
+        """ Writes the trace as JSON, viewable in chrome://tracing, Perfetto or speedscope. """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f)
+
+
+PROFILER = Profiler()
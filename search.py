@@ -0,0 +1,87 @@
+from base import Slideshow
+
+import time
+
+
+class Deadline:
+    """
+    Time budget of an anytime search, measured with time.perf_counter.
+    Searches check it cooperatively (at every iteration of every level) and stop as soon as it is expired,
+    keeping the best solution found so far.
+    Since perf_counter is a system-wide monotonic clock, a deadline remains valid in forked worker processes.
+    """
+
+    def __init__(self, budget=None):
+        """
+        :param budget: Number of seconds, None for no limit.
+        """
+        self.budget = budget
+        self.start = time.perf_counter()
+        self.end = None if budget is None else self.start + budget
+
+    def expired(self):
+        return self.end is not None and time.perf_counter() >= self.end
+
+    def remaining(self):
+        """ Seconds left, inf if there is no limit. """
+        return float('inf') if self.end is None else max(self.end - time.perf_counter(), 0.)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+class Incumbent:
+    """
+    Best complete solution found so far by a search : its score and its sequence of slide indexes.
+    """
+
+    def __init__(self):
+        self.score = float('-inf')
+        self.sequence = None
+
+    def update(self, score, sequence):
+        """ Keeps (score, sequence) if it is better than the incumbent. Returns True if it was kept. """
+        if score > self.score:
+            self.score = score
+            self.sequence = list(sequence)
+            return True
+        return False
+
+    def __bool__(self):
+        return self.sequence is not None
+
+
+class AnytimeSearch:
+    """
+    Deadline-aware search interface shared by the Monte Carlo solvers.
+    A search is started by start_search, which sets the deadline and resets the incumbent. While it runs,
+    the search checks self.deadline.expired() and reports every complete solution to self.incumbent,
+    so that best_slideshow can be called at any moment.
+    A search also stops once its best score reaches target, e.g. an upper bound on the score (see bounds.py) :
+    no better solution exists.
+    """
+
+    deadline = Deadline()  # No limit until a search is started
+    incumbent = None
+    target = None  # Score at which searches stop, None for no target
+
+    def start_search(self, budget=None):
+        """
+        :param budget: Time budget of the search in seconds, None for no limit.
+        """
+        self.deadline = Deadline(budget)
+        self.incumbent = Incumbent()
+        return self.deadline
+
+    def best_score(self):
+        """ Score of the best complete solution found so far. """
+        return self.incumbent.score if self.incumbent else float('-inf')
+
+    def expired(self):
+        """ True if the deadline is expired or the target is reached. """
+        return self.deadline.expired() or (self.target is not None and self.best_score() >= self.target)
+
+    def best_slideshow(self):
+        """ Slideshow of the best complete solution found so far (empty if there is none yet). """
+        sequence = (self.incumbent.sequence if self.incumbent else None) or []
+        return Slideshow.from_indexes(self.slides, sequence, store=getattr(self, 'store', None))
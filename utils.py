@@ -1,15 +1,22 @@
+from profiling import PROFILER
+
+import functools
 import time
 
 
 def timeit(f):
+    """ Prints the duration of every call of f, which is also recorded as a span when profiling is enabled
+    (see profiling.PROFILER).
+    """
 
+    @functools.wraps(f)
     def timed(*args, **kw):
-        ts = time.time()
-        result = f(*args, **kw)
-        te = time.time()
+        with PROFILER.span(f.__name__):
+            ts = time.perf_counter_ns()
+            result = f(*args, **kw)
+            te = time.perf_counter_ns()
 
-        print('func:%r took: %2.4f sec' % (f.__name__, te-ts))
+        print('func:%r took: %2.4f sec' % (f.__name__, (te-ts) / 1e9))
         return result
 
     return timed
-